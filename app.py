@@ -1,9 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, Response
 from flask_mail import Mail, Message
 from models import db, User, Post, Message, Mentorship, Job, Event, Badge, Question, Answer, Connection, RSVP, JobApplication, Activity, Like, Comment, Notification
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from index import build_inverted_index, search_inverted_index, rank_results
+from index import search_index
+from fts import init_fts, search_content
+from graph import social_graph
+from timeline import timelines, feed_page
+from migrations import run_migrations
+from stats import get_user_stats, invalidate_user_stats
+from conversations import record_message, mark_conversation_read, inbox, chat_channel, message_event, chat_history
+from pubsub import chat_hub
+from side_effects import on_commit, activity_queue
+from fanout import fan_out, fanout_worker
+from notifications import add_notification, unread_counts, unread_count, mark_read, mark_all_read, remove_notification, notifications_page
+from retention import DEFAULT_TTLS, retention_job
+from scores import bump_score, award_badges, position_badge_job, POSITION_BADGES
+from leaderboards import WINDOWS, leaderboard_rows, leaderboard_job
+from metrics import SERIES, RESOLUTIONS, totals, series
+from instrumentation import request_metrics
+import hmac
+import json
 import os
 import uuid
 from datetime import datetime, timedelta
@@ -14,14 +31,110 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def create_activity(user_id, activity_type, description, related_id=None):
-    activity = Activity(user_id=user_id, activity_type=activity_type, description=description, related_id=related_id)
-    db.session.add(activity)
-    db.session.commit()
+    """Record an activity with the request's changes; the caller commits.
+
+    With ACTIVITY_WRITE_BEHIND on, the row is queued once the request
+    commits and inserted in the background instead.
+    """
+    values = dict(user_id=user_id, activity_type=activity_type, description=description,
+                  related_id=related_id, created_at=datetime.utcnow())
+    if activity_queue.running:
+        on_commit(lambda: activity_queue.put(**values))
+    else:
+        db.session.add(Activity(**values))
+
+def create_notification(user_id, notification_type, title, message, related_id=None, group_key=None, summary=None):
+    """Add a notification to the request's changes; the caller commits.
+
+    Repeats with the same group_key are coalesced using summary, see
+    notifications.add_notification.
+    """
+    add_notification(user_id, notification_type, title, message, related_id, group_key, summary)
+
+def get_connection_ids(user_id):
+    """Return the set of user IDs with an accepted connection to user_id."""
+    return set(social_graph.neighbours(user_id))
+
+def count_mutual_connections(user_ids, viewer_connection_ids):
+    """Return {user_id: mutual connection count} against the viewer's connections.
+
+    Answered from the in-memory social graph, with no queries.
+    """
+    return {user_id: len(viewer_connection_ids.intersection(social_graph.neighbours(user_id)))
+            for user_id in user_ids}
+
+def load_users(user_ids):
+    """Load users with one IN query, keeping the order of user_ids."""
+    if not user_ids:
+        return []
+    users_by_id = {user.id: user for user in User.query.filter(User.id.in_(user_ids)).all()}
+    return [users_by_id[uid] for uid in user_ids if uid in users_by_id]
+
+def load_users_with_mutuals(user_ids, viewer_id, viewer_connection_ids):
+    """Load users in the given order with `mutual_connections` set on each."""
+    users = load_users(user_ids)
+    mutual_counts = count_mutual_connections([user.id for user in users if user.id != viewer_id], viewer_connection_ids)
+    for user in users:
+        user.mutual_connections = mutual_counts.get(user.id, 0)
+    return users
+
+def parse_search_filters(form):
+    """Read the /search facet filters (role, batch year range, required skills) from a form."""
+    filters = {}
+    role = form.get('role')
+    if role in ('student', 'alumni', 'faculty'):
+        filters['role'] = role
+    for key in ('year_from', 'year_to'):
+        value = form.get(key, '').strip()
+        if value.isdigit():
+            filters[key] = int(value)
+    skills = [skill.strip() for skill in form.get('skills', '').split(',') if skill.strip()]
+    if skills:
+        filters['skills'] = skills
+    return filters
+
+def load_dashboard_data(user):
+    """Gather everything the dashboard renders for user.
+
+    Counters come from the in-memory graph and one cached aggregate query;
+    post and activity authors are eager-loaded so the template does no
+    lazy loads.
+    """
+    posts, next_cursor = feed_page([user.role, 'all'], limit=10)
 
-def create_notification(user_id, notification_type, title, message, related_id=None):
-    notification = Notification(user_id=user_id, type=notification_type, title=title, message=message, related_id=related_id)
-    db.session.add(notification)
-    db.session.commit()
+    # Count actual accepted connections
+    connection_ids = social_graph.neighbours(user.id)
+    stats = get_user_stats(user.id)
+
+    # Get recent activities from connections and general activities
+    activities = Activity.query.options(db.joinedload(Activity.user)).filter(
+        Activity.user_id.in_(list(connection_ids) + [user.id])
+    ).order_by(Activity.created_at.desc()).limit(20).all()
+
+    # People you may know: friends of friends without a pending request either way
+    pending = db.session.query(Connection.sender_id, Connection.receiver_id).filter(
+        ((Connection.sender_id == user.id) | (Connection.receiver_id == user.id)) &
+        (Connection.status == 'pending')
+    ).all()
+    suggestions = social_graph.recommend(user.id, limit=5, exclude={uid for pair in pending for uid in pair})
+    suggested_users = load_users([uid for uid, _ in suggestions])
+    mutual_counts = dict(suggestions)
+    for suggested in suggested_users:
+        suggested.mutual_connections = mutual_counts[suggested.id]
+
+    # Get recent notifications
+    recent_notifications = Notification.query.filter_by(user_id=user.id).order_by(Notification.created_at.desc()).limit(5).all()
+
+    return {
+        'posts': posts,
+        'next_cursor': next_cursor,
+        'posts_count': stats['posts_count'],
+        'connections_count': len(connection_ids),
+        'badges_count': stats['badges_count'],
+        'activities': activities,
+        'recent_notifications': recent_notifications,
+        'suggested_users': suggested_users,
+    }
 
 def format_datetime_ist(dt):
     """Convert UTC datetime to IST and format it"""
@@ -31,46 +144,61 @@ def format_datetime_ist(dt):
         return ist_time.strftime('%b %d, %I:%M %p')
     return ''
 
-def award_badges(user_id):
-    user = User.query.get(user_id)
-    posts_count = Post.query.filter_by(user_id=user_id).count()
-    messages_count = Message.query.filter_by(sender_id=user_id).count()
-    jobs_count = Job.query.filter_by(user_id=user_id).count()
-    events_count = Event.query.filter_by(user_id=user_id).count()
-
-    badges = []
-
-    if posts_count >= 1 and not Badge.query.filter_by(user_id=user_id, badge_type='First Post').first():
-        badges.append(Badge(user_id=user_id, badge_type='First Post'))
-
-    if posts_count >= 5 and not Badge.query.filter_by(user_id=user_id, badge_type='Active Poster').first():
-        badges.append(Badge(user_id=user_id, badge_type='Active Poster'))
-
-    if messages_count >= 10 and not Badge.query.filter_by(user_id=user_id, badge_type='Social Butterfly').first():
-        badges.append(Badge(user_id=user_id, badge_type='Social Butterfly'))
-
-    if jobs_count >= 1 and not Badge.query.filter_by(user_id=user_id, badge_type='Job Creator').first():
-        badges.append(Badge(user_id=user_id, badge_type='Job Creator'))
+def dispatch_fan_out(sender_id, recipient_ids, **kwargs):
+    """Fan out inline, or on the background worker for large audiences.
 
-    if events_count >= 1 and not Badge.query.filter_by(user_id=user_id, badge_type='Event Organizer').first():
-        badges.append(Badge(user_id=user_id, badge_type='Event Organizer'))
-
-    for badge in badges:
-        db.session.add(badge)
-    db.session.commit()
+    Returns the background job ID, or None if it already ran.
+    """
+    if len(recipient_ids) > app.config['FANOUT_BACKGROUND_THRESHOLD']:
+        return fanout_worker.submit(app, sender_id, recipient_ids, **kwargs)
+    fan_out(sender_id, recipient_ids, **kwargs)
+    return None
 
 def send_job_notification(job):
-    """Send email notification to all registered students about new job posting"""
+    """Notify all registered students about a new job posting"""
+    student_ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.role == 'student').all()]
+    dispatch_fan_out(job.user_id, student_ids, notification={
+        'type': 'job_posted',
+        'title': 'New Job Posted',
+        'message': f'{job.user.username} posted a new job: {job.title}',
+        'related_id': job.id,
+    })
     # Email functionality is currently disabled
     # To enable email notifications, uncomment the mail configuration in app.py
     # and set up proper SMTP credentials
-    print(f"Job notification would be sent to students for: {job.title}")
-    print("Email functionality is currently disabled. Configure MAIL settings to enable.")
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key_here'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///alumni.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SEARCH_FTS_ENABLED'] = True
+app.config['SEARCH_INDEX_SNAPSHOT'] = os.path.join(app.instance_path, 'search_index.bin')
+# memory:// for a single process; database:// or redis://... when running several workers
+app.config['CHAT_BROKER_URL'] = os.environ.get('CHAT_BROKER_URL', 'memory://')
+app.config['CHAT_STREAM_KEEPALIVE'] = 15
+app.config['CHAT_PAGE_SIZE'] = 50
+# Insert activity feed rows from a background queue instead of the request's transaction
+app.config['ACTIVITY_WRITE_BEHIND'] = os.environ.get('ACTIVITY_WRITE_BEHIND') == '1'
+# Fan-outs to more recipients than this run on a background worker
+app.config['FANOUT_BACKGROUND_THRESHOLD'] = 200
+# Activity/notification retention: per-type TTLs in days, archived to gzipped JSON lines
+app.config['RETENTION_TTLS'] = DEFAULT_TTLS
+app.config['RETENTION_ARCHIVE_DIR'] = os.path.join(app.instance_path, 'archive')
+app.config['RETENTION_BATCH_SIZE'] = 500
+app.config['RETENTION_VACUUM_PAGES'] = 1000
+app.config['RETENTION_INTERVAL'] = 6 * 60 * 60  # seconds; 0 disables the scheduled job
+app.config['LEADERBOARD_SIZE'] = 100
+app.config['POSITION_BADGE_INTERVAL'] = 60  # seconds between background position badge updates
+app.config['LEADERBOARD_INTERVAL'] = 5 * 60  # seconds between rebuilds of the weekly/monthly boards
+# Run the scheduled jobs above in this process; `python app.py` always does
+app.config['BACKGROUND_JOBS'] = os.environ.get('BACKGROUND_JOBS') == '1'
+# Request instrumentation: statements slower than this (seconds) go to the slow query log,
+# and X-Query-Count/X-DB-Time-Ms response headers can be switched on for debugging
+app.config['SLOW_QUERY_THRESHOLD'] = 0.1
+app.config['SLOW_QUERY_LOG_INTERVAL'] = 60  # seconds between warnings for the same statement fingerprint
+app.config['QUERY_COUNT_HEADER'] = os.environ.get('QUERY_COUNT_HEADER') == '1'
+# Bearer token for /admin/metrics and /admin/slow_queries; both return 403 while it is unset
+app.config['ADMIN_METRICS_TOKEN'] = os.environ.get('ADMIN_METRICS_TOKEN')
 
 # Mail configuration - DISABLED for now (commented out)
 # app.config['MAIL_SERVER'] = 'smtp.gmail.com'
@@ -88,7 +216,36 @@ db.init_app(app)
 
 # Create database
 with app.app_context():
-    db.create_all()
+    run_migrations()
+    # Map the shared search index snapshot (built on first run); write paths keep it up to date
+    search_index.open(app.config['SEARCH_INDEX_SNAPSHOT'])
+    init_fts(app)
+    social_graph.open(os.path.join(app.instance_path, 'social_graph.stamp'))
+    timelines.open(os.path.join(app.instance_path, 'timelines.stamp'))
+    unread_counts.open(os.path.join(app.instance_path, 'notifications.stamp'))
+    chat_hub.configure(app.config['CHAT_BROKER_URL'], db.engine)
+    if app.config['ACTIVITY_WRITE_BEHIND']:
+        activity_queue.start(app)
+    request_metrics.init_app(app)
+
+def start_background_jobs():
+    """Start the scheduled retention, position badge and leaderboard jobs in this process."""
+    retention_job.start(app, app.config['RETENTION_INTERVAL'])
+    position_badge_job.start(app, app.config['POSITION_BADGE_INTERVAL'])
+    leaderboard_job.start(app, app.config['LEADERBOARD_INTERVAL'])
+    leaderboard_job.trigger()  # build the windowed boards now rather than after the first interval
+
+# Scripts that import app (populate.py, migrations.py, retention.py) must not
+# start them; under a WSGI server set BACKGROUND_JOBS=1 for one process only
+if app.config['BACKGROUND_JOBS']:
+    start_background_jobs()
+
+@app.context_processor
+def inject_unread_notifications():
+    """Unread notification count for the navbar badge, from the cached counter."""
+    if 'user_id' not in session:
+        return {}
+    return {'unread_notifications': unread_count(session['user_id'])}
 
 @app.route('/')
 def index():
@@ -129,6 +286,7 @@ def register():
             existing_alumni.batch_year = batch_year
             existing_alumni.skills = skills
             db.session.commit()
+            search_index.add_user(existing_alumni)
             flash('Registration successful!')
             return redirect(url_for('login'))
         elif role == 'faculty':
@@ -149,6 +307,7 @@ def register():
             existing_faculty.email = email
             existing_faculty.password = password
             db.session.commit()
+            search_index.add_user(existing_faculty)
             flash('Registration successful!')
             return redirect(url_for('login'))
         else:
@@ -165,6 +324,7 @@ def register():
             new_user = User(username=username, email=email, password=password, role=role, batch_year=batch_year, skills=skills)
             db.session.add(new_user)
             db.session.commit()
+            search_index.add_user(new_user)
             flash('Registration successful!')
             return redirect(url_for('login'))
     return render_template('register.html')
@@ -198,39 +358,7 @@ def dashboard():
     if not user:
         session.pop('user_id', None)
         return redirect(url_for('login'))
-    posts = Post.query.filter((Post.audience == user.role) | (Post.audience == 'all')).order_by(Post.timestamp.desc()).limit(10).all()
-
-    # Calculate user stats
-    posts_count = Post.query.filter_by(user_id=user.id).count()
-
-    # Count actual accepted connections
-    connections_count = Connection.query.filter(
-        ((Connection.sender_id == user.id) | (Connection.receiver_id == user.id)) &
-        (Connection.status == 'accepted')
-    ).count()
-
-    badges_count = Badge.query.filter_by(user_id=user.id).count()
-
-    # Get recent activities from connections and general activities
-    connection_ids = db.session.query(Connection.sender_id).filter(
-        Connection.receiver_id == user.id, Connection.status == 'accepted'
-    ).union(
-        db.session.query(Connection.receiver_id).filter(
-            Connection.sender_id == user.id, Connection.status == 'accepted'
-        )
-    ).subquery()
-
-    activities = Activity.query.filter(
-        db.or_(
-            Activity.user_id.in_(connection_ids),
-            Activity.user_id == user.id
-        )
-    ).order_by(Activity.created_at.desc()).limit(20).all()
-
-    # Get recent notifications
-    recent_notifications = Notification.query.filter_by(user_id=user.id).order_by(Notification.created_at.desc()).limit(5).all()
-
-    return render_template('dashboard.html', user=user, posts=posts, posts_count=posts_count, connections_count=connections_count, badges_count=badges_count, activities=activities, recent_notifications=recent_notifications, format_datetime_ist=format_datetime_ist)
+    return render_template('dashboard.html', user=user, format_datetime_ist=format_datetime_ist, **load_dashboard_data(user))
 
 @app.route('/profile', methods=['GET', 'POST'])
 def profile():
@@ -243,6 +371,7 @@ def profile():
         user.batch_year = request.form.get('batch_year')
         user.skills = request.form.get('skills')
         db.session.commit()
+        search_index.add_user(user)
         flash('Profile updated successfully!')
         return redirect(url_for('profile'))
     return render_template('profile.html', user=user)
@@ -271,48 +400,52 @@ def create_post():
                 media_type = 'video'
     post = Post(user_id=user_id, content=content, audience=audience, media_type=media_type, media_path=media_path)
     db.session.add(post)
-    db.session.commit()
-    award_badges(user_id)
+    db.session.flush()
+    award_badges(user_id, bump_score(user_id, 'posts_count'))
 
     # Create activity
     create_activity(user_id, 'post_created', f'Created a new post', post.id)
+    db.session.commit()
+    timelines.add(post)
+    invalidate_user_stats(user_id)
 
     flash('Post created!')
     return redirect(url_for('dashboard'))
 
+@app.route('/feed')
+def feed():
+    if 'user_id' not in session:
+        return {'success': False}, 401
+    user = User.query.get(session['user_id'])
+    if not user:
+        session.pop('user_id', None)
+        return {'success': False}, 401
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    posts, next_cursor = feed_page([user.role, 'all'], cursor=request.args.get('before'), limit=limit)
+    return {
+        'success': True,
+        'posts': [{
+            'id': post.id,
+            'user_id': post.user_id,
+            'username': post.user.username,
+            'content': post.content,
+            'audience': post.audience,
+            'media_type': post.media_type,
+            'media_path': post.media_path,
+            'timestamp': post.timestamp.isoformat(),
+        } for post in posts],
+        'html': render_template('_post_cards.html', posts=posts, format_datetime_ist=format_datetime_ist),
+        'next_cursor': next_cursor
+    }
+
 @app.route('/messages')
 def messages():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     user_id = session['user_id']
 
-    # Get all unique conversations (users who have messaged with current user)
-    sent_to = db.session.query(Message.receiver_id).filter_by(sender_id=user_id).distinct().all()
-    received_from = db.session.query(Message.sender_id).filter_by(receiver_id=user_id).distinct().all()
-
-    conversation_user_ids = set()
-    for user_tuple in sent_to + received_from:
-        conversation_user_ids.add(user_tuple[0])
-
-    conversations = []
-    for other_user_id in conversation_user_ids:
-        if other_user_id != user_id:
-            other_user = User.query.get(other_user_id)
-            # Get the latest message in this conversation
-            latest_message = Message.query.filter(
-                ((Message.sender_id == user_id) & (Message.receiver_id == other_user_id)) |
-                ((Message.sender_id == other_user_id) & (Message.receiver_id == user_id))
-            ).order_by(Message.timestamp.desc()).first()
-
-            if latest_message:
-                conversations.append({
-                    'user': other_user,
-                    'latest_message': latest_message,
-                    'unread_count': Message.query.filter_by(sender_id=other_user_id, receiver_id=user_id).count()
-                })
-
-    # Sort conversations by latest message timestamp
-    conversations.sort(key=lambda x: x['latest_message'].timestamp, reverse=True)
+    # Conversation summaries, newest first, with real unread counts
+    conversations = inbox(user_id)
 
     return render_template('messages.html', conversations=conversations)
 
@@ -350,8 +483,9 @@ def send_message():
 
         message = Message(sender_id=sender_id, receiver_id=receiver.id, content=content, media_type=media_type, media_path=media_path)
         db.session.add(message)
+        record_message(message)
+        award_badges(sender_id, bump_score(sender_id, 'messages_count'))
         db.session.commit()
-        award_badges(sender_id)
         flash('Message sent!')
     else:
         flash('User not found!')
@@ -394,11 +528,10 @@ def send_chat_message():
 
     message = Message(sender_id=sender_id, receiver_id=receiver_id, content=content, media_type=media_type, media_path=media_path)
     db.session.add(message)
-    db.session.commit()
-    award_badges(sender_id)
+    record_message(message)
+    award_badges(sender_id, bump_score(sender_id, 'messages_count'))
 
     # Create activity
-    receiver = User.query.get(receiver_id)
     create_activity(sender_id, 'message_sent', f'Sent a message to {receiver.username}')
 
     # Create notification for receiver
@@ -407,18 +540,15 @@ def send_chat_message():
         notification_message = f"{sender.username} sent you a message: {content[:50]}{'...' if len(content) > 50 else ''}"
     else:
         notification_message = f"{sender.username} sent you a media message"
-    create_notification(receiver_id, 'message', 'New Message', notification_message, message.id)
+    create_notification(receiver_id, 'message', 'New Message', notification_message, message.id,
+                        group_key=f'user:{sender_id}', summary=f'{sender.username} sent you {{count}} messages')
 
-    return {
-        'success': True,
-        'message': {
-            'content': content,
-            'media_type': media_type,
-            'media_path': media_path,
-            'timestamp': message.timestamp.isoformat(),
-            'sender_id': sender_id
-        }
-    }
+    # Message, badges, activity and notification go in one transaction
+    db.session.commit()
+    event = message_event(message)
+    chat_hub.publish(chat_channel(sender_id, receiver_id), event)
+
+    return {'success': True, 'message': event}
 
 @app.route('/mentorship')
 def mentorship():
@@ -474,13 +604,14 @@ def jobs():
         job_type = request.form['job_type']
         job = Job(user_id=user_id, title=title, description=description, job_type=job_type)
         db.session.add(job)
-        db.session.commit()
-        award_badges(user_id)
+        db.session.flush()
+        award_badges(user_id, bump_score(user_id, 'jobs_count'))
 
         # Create activity
         create_activity(user_id, 'job_posted', f'Posted a new job: {title}', job.id)
+        db.session.commit()
 
-        # Send email notification to all students
+        # Notify all students
         send_job_notification(job)
 
         flash('Job posted successfully!')
@@ -505,11 +636,12 @@ def events():
         registration_link = request.form.get('registration_link')
         event = Event(user_id=user_id, title=title, description=description, date=date, location=location, registration_link=registration_link)
         db.session.add(event)
-        db.session.commit()
-        award_badges(user_id)
+        db.session.flush()
+        award_badges(user_id, bump_score(user_id, 'events_count'))
 
         # Create activity
         create_activity(user_id, 'event_created', f'Created a new event: {title}', event.id)
+        db.session.commit()
 
         flash('Event created!')
         return redirect(url_for('events'))
@@ -528,7 +660,7 @@ def rsvp(event_id):
     else:
         rsvp = RSVP(user_id=user_id, event_id=event_id, status=status)
         db.session.add(rsvp)
-    db.session.commit()
+    db.session.flush()
 
     # Create notification for event creator if status is 'yes'
     if status == 'yes':
@@ -536,7 +668,9 @@ def rsvp(event_id):
         if event and event.user_id != user_id:  # Don't notify if user is the event creator
             attendee = User.query.get(user_id)
             create_notification(event.user_id, 'event_rsvp', 'New Event RSVP',
-                              f'{attendee.username} is attending your event: {event.title}', rsvp.id)
+                              f'{attendee.username} is attending your event: {event.title}', rsvp.id,
+                              group_key=f'event:{event.id}', summary=f'{{count}} people are attending your event: {event.title}')
+    db.session.commit()
 
     flash('RSVP updated!')
     return redirect(url_for('events'))
@@ -552,61 +686,73 @@ def badges():
 def leaderboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    users = User.query.all()
-    scores = []
-    for user in users:
-        score = (Post.query.filter_by(user_id=user.id).count() * 10 +
-                 Message.query.filter_by(sender_id=user.id).count() * 5 +
-                 Job.query.filter_by(user_id=user.id).count() * 20 +
-                 Event.query.filter_by(user_id=user.id).count() * 15 +
-                 Badge.query.filter_by(user_id=user.id).count() * 25)
-        scores.append({'user': user, 'score': score})
-    scores.sort(key=lambda x: x['score'], reverse=True)
-
-    # Remove existing position badges
-    db.session.query(Badge).filter(Badge.badge_type.in_(['1st Place', '2nd Place', '3rd Place'])).delete()
-    db.session.commit()
-
-    # Assign position badges to top 3
-    for i, item in enumerate(scores[:3]):
-        badge_type = f"{i+1}st Place" if i == 0 else f"{i+1}nd Place" if i == 1 else f"{i+1}rd Place"
-        badge = Badge(user_id=item['user'].id, badge_type=badge_type)
-        db.session.add(badge)
-    db.session.commit()
-
-    # Add position badge info to scores
-    for item in scores:
-        position_badges = Badge.query.filter(
-            Badge.user_id == item['user'].id,
-            Badge.badge_type.in_(['1st Place', '2nd Place', '3rd Place'])
-        ).all()
-        item['position_badge'] = position_badges[0] if position_badges else None
-
-    return render_template('leaderboard.html', leaderboard=scores)
+    window = request.args.get('window', 'all')
+    if window != 'all' and window not in WINDOWS:
+        window = 'all'
+    batch_year = request.args.get('batch_year', type=int)
+    # Scores are maintained by the write paths, the weekly/monthly boards by
+    # leaderboard_job and position badges by position_badge_job, so viewing
+    # the leaderboard never writes
+    position_badges = {}
+    if window == 'all' and batch_year is None:
+        for badge in Badge.query.filter(Badge.badge_type.in_(POSITION_BADGES)).order_by(Badge.id):
+            position_badges.setdefault(badge.user_id, badge)
+    scores = [{'user': user, 'score': score, 'position_badge': position_badges.get(user.id)}
+              for user, score in leaderboard_rows(window, batch_year, app.config['LEADERBOARD_SIZE'])]
+    batch_years = [year for (year,) in db.session.query(User.batch_year).filter(
+        User.batch_year.isnot(None)).distinct().order_by(User.batch_year.desc())]
+
+    return render_template('leaderboard.html', leaderboard=scores, window=window, windows=['all', *WINDOWS],
+                           batch_year=batch_year, batch_years=batch_years)
 
 @app.route('/metrics')
 def metrics():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    # Simple metrics
-    total_users = User.query.count()
-    total_posts = Post.query.count()
-    total_messages = Message.query.count()
-    total_jobs = Job.query.count()
-    total_events = Event.query.count()
-    total_badges = Badge.query.count()
-    mentorship_requests = Mentorship.query.count()
-    accepted_mentorships = Mentorship.query.filter_by(status='accepted').count()
+    # Totals are kept in metric_total by the write paths, so this is one small read
+    counts = totals()
 
     return render_template('metrics.html',
-                           total_users=total_users,
-                           total_posts=total_posts,
-                           total_messages=total_messages,
-                           total_jobs=total_jobs,
-                           total_events=total_events,
-                           total_badges=total_badges,
-                           mentorship_requests=mentorship_requests,
-                           accepted_mentorships=accepted_mentorships)
+                           total_users=counts['users'],
+                           total_posts=counts['posts'],
+                           total_messages=counts['messages'],
+                           total_jobs=counts['jobs'],
+                           total_events=counts['events'],
+                           total_badges=counts['badges'],
+                           mentorship_requests=counts['mentorships'],
+                           accepted_mentorships=counts['mentorships_accepted'],
+                           series_names=list(SERIES))
+
+@app.route('/metrics/series')
+def metrics_series():
+    if 'user_id' not in session:
+        return {'success': False}, 401
+    name = request.args.get('metric', 'users')
+    resolution = request.args.get('resolution', 'day')
+    if name not in SERIES or resolution not in RESOLUTIONS:
+        return {'success': False, 'error': 'Unknown metric or resolution'}, 400
+    default_points = 48 if resolution == 'hour' else 30
+    kept = RESOLUTIONS[resolution] // (timedelta(hours=1) if resolution == 'hour' else timedelta(days=1))
+    points = min(max(request.args.get('points', default_points, type=int), 1), kept)
+    return {'success': True, 'metric': name, 'resolution': resolution,
+            'points': [[start.isoformat(), value] for start, value in series(name, resolution, points)]}
+
+def admin_metrics_allowed():
+    # No token, no access: behind a local reverse proxy every client looks like loopback
+    token = app.config['ADMIN_METRICS_TOKEN']
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    if not admin_metrics_allowed():
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(request_metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/slow_queries')
+def admin_slow_queries():
+    if not admin_metrics_allowed():
+        return {'success': False}, 403
+    return {'success': True, 'threshold': app.config['SLOW_QUERY_THRESHOLD'], 'queries': request_metrics.slow_query_log()}
 
 @app.route('/search', methods=['GET', 'POST'])
 def search():
@@ -617,88 +763,39 @@ def search():
     page = int(request.args.get('page', 1))
     per_page = 15
 
-    # Get current user's connections for checking connection status
+    # Get current user's accepted connections for connection status and mutual connections
     current_user_id = session['user_id']
-    connections = Connection.query.filter(
-        ((Connection.sender_id == current_user_id) | (Connection.receiver_id == current_user_id)) &
-        (Connection.status == 'accepted')
-    ).all()
-
-    # Get current user's accepted connections for mutual connections calculation
-    user_connections = set()
-    for conn in connections:
-        if conn.sender_id == current_user_id:
-            user_connections.add(conn.receiver_id)
-        else:
-            user_connections.add(conn.sender_id)
+    user_connections = get_connection_ids(current_user_id)
 
     if request.method == 'POST':
         query = request.form['query']
-        inverted_index = build_inverted_index()
-        user_ids = search_inverted_index(query, inverted_index)
-        ranked_ids = rank_results(user_ids, query, inverted_index)
-        total_results = len(ranked_ids)
-
-        # Pagination
-        start = (page - 1) * per_page
-        end = start + per_page
-        paginated_ids = ranked_ids[start:end]
-        results = [User.query.get(uid) for uid in paginated_ids]
-
-        # Calculate mutual connections for each result
-        for user in results:
-            if user.id != current_user_id:
-                user_connections_set = set()
-                user_conns = Connection.query.filter(
-                    ((Connection.sender_id == user.id) | (Connection.receiver_id == user.id)) &
-                    (Connection.status == 'accepted')
-                ).all()
-                for conn in user_conns:
-                    if conn.sender_id == user.id:
-                        user_connections_set.add(conn.receiver_id)
-                    else:
-                        user_connections_set.add(conn.sender_id)
-                mutual_count = len(user_connections & user_connections_set)
-                user.mutual_connections = mutual_count
-            else:
-                user.mutual_connections = 0
-
+        mode = request.form.get('mode', 'people')
+        filters = parse_search_filters(request.form)
         # Store query in session for pagination links
         session['search_query'] = query
+        session['search_mode'] = mode
+        session['search_filters'] = filters
     else:
         # Handle pagination for GET requests
         query = session.get('search_query', '')
+        mode = session.get('search_mode', 'people')
+        filters = session.get('search_filters', {})
+
+    hits = []
+    facet_counts = {}
+    start = (page - 1) * per_page
+    end = start + per_page
+    if mode == 'content':
         if query:
-            inverted_index = build_inverted_index()
-            user_ids = search_inverted_index(query, inverted_index)
-            ranked_ids = rank_results(user_ids, query, inverted_index)
-            total_results = len(ranked_ids)
-
-            start = (page - 1) * per_page
-            end = start + per_page
-            paginated_ids = ranked_ids[start:end]
-            results = [User.query.get(uid) for uid in paginated_ids]
-
-            # Calculate mutual connections for each result
-            for user in results:
-                if user.id != current_user_id:
-                    user_connections_set = set()
-                    user_conns = Connection.query.filter(
-                        ((Connection.sender_id == user.id) | (Connection.receiver_id == user.id)) &
-                        (Connection.status == 'accepted')
-                    ).all()
-                    for conn in user_conns:
-                        if conn.sender_id == user.id:
-                            user_connections_set.add(conn.receiver_id)
-                        else:
-                            user_connections_set.add(conn.sender_id)
-                    mutual_count = len(user_connections & user_connections_set)
-                    user.mutual_connections = mutual_count
-                else:
-                    user.mutual_connections = 0
+            # Posts, jobs, events and Q&A, matched and ranked by SQLite FTS5
+            hits, total_results = search_content(query, limit=per_page, offset=start)
+    elif query or filters:
+        ranked_ids, total_results = search_index.search(query, limit=end, filters=filters)
+        results = load_users_with_mutuals(ranked_ids[start:end], current_user_id, user_connections)
+        facet_counts = search_index.facet_counts(query, filters)
 
     total_pages = (total_results + per_page - 1) // per_page
-    return render_template('search.html', results=results, query=query, page=page, total_pages=total_pages, total_results=total_results, connections=connections)
+    return render_template('search.html', results=results, hits=hits, mode=mode, query=query, filters=filters, facet_counts=facet_counts, page=page, total_pages=total_pages, total_results=total_results, connected_ids=user_connections)
 
 @app.route('/myconnections')
 def myconnections():
@@ -732,7 +829,7 @@ def send_connection_request():
     if not existing_connection:
         connection = Connection(sender_id=sender_id, receiver_id=receiver_id)
         db.session.add(connection)
-        db.session.commit()
+        db.session.flush()
 
         # Create activity
         receiver = User.query.get(receiver_id)
@@ -742,6 +839,7 @@ def send_connection_request():
         sender = User.query.get(sender_id)
         create_notification(receiver_id, 'connection_request', 'New Connection Request',
                           f'{sender.username} sent you a connection request', connection.id)
+        db.session.commit()
 
         flash('Connection request sent!')
     else:
@@ -776,6 +874,8 @@ def respond_connection(request_id):
                               f'{receiver.username} declined your connection request', connection.id)
 
         db.session.commit()
+        if connection.status == 'accepted':
+            social_graph.add_edge(connection.sender_id, connection.receiver_id)
 
     return redirect(url_for('myconnections'))
 
@@ -795,33 +895,8 @@ def view_profile(user_id):
     is_connected = connection is not None
 
     # Calculate mutual connections
-    current_user_connections = set()
-    user_connections = set()
-
-    # Get current user's connections
-    current_conns = Connection.query.filter(
-        ((Connection.sender_id == current_user_id) | (Connection.receiver_id == current_user_id)) &
-        (Connection.status == 'accepted')
-    ).all()
-    for conn in current_conns:
-        if conn.sender_id == current_user_id:
-            current_user_connections.add(conn.receiver_id)
-        else:
-            current_user_connections.add(conn.sender_id)
-
-    # Get profile user's connections
-    profile_conns = Connection.query.filter(
-        ((Connection.sender_id == user_id) | (Connection.receiver_id == user_id)) &
-        (Connection.status == 'accepted')
-    ).all()
-    for conn in profile_conns:
-        if conn.sender_id == user_id:
-            user_connections.add(conn.receiver_id)
-        else:
-            user_connections.add(conn.sender_id)
-
-    mutual_connections = current_user_connections & user_connections
-    mutual_count = len(mutual_connections)
+    current_user_connections = get_connection_ids(current_user_id)
+    mutual_count = count_mutual_connections([user_id], current_user_connections)[user_id]
 
     # Get user's posts
     posts = Post.query.filter_by(user_id=user_id).order_by(Post.timestamp.desc()).all()
@@ -843,7 +918,7 @@ def apply_job(job_id):
 
     application = JobApplication(job_id=job_id, applicant_id=user_id)
     db.session.add(application)
-    db.session.commit()
+    db.session.flush()
 
     # Create activity
     create_activity(user_id, 'job_applied', f'Applied for job: {job.title}', job.id)
@@ -851,7 +926,9 @@ def apply_job(job_id):
     # Create notification for job poster
     applicant = User.query.get(user_id)
     create_notification(job.user_id, 'job_application', 'New Job Application',
-                      f'{applicant.username} applied for your job: {job.title}', application.id)
+                      f'{applicant.username} applied for your job: {job.title}', application.id,
+                      group_key=f'job:{job.id}', summary=f'{{count}} people applied for your job: {job.title}')
+    db.session.commit()
 
     flash('Application submitted successfully!')
     return redirect(url_for('view_job', job_id=job_id))
@@ -873,13 +950,74 @@ def chat(user_id):
     current_user_id = session['user_id']
     other_user = User.query.get_or_404(user_id)
 
-    # Get all messages between current user and the other user
-    messages = Message.query.filter(
-        ((Message.sender_id == current_user_id) & (Message.receiver_id == user_id)) |
-        ((Message.sender_id == user_id) & (Message.receiver_id == current_user_id))
-    ).order_by(Message.timestamp).all()
+    # Opening the chat reads everything the other user sent
+    mark_conversation_read(current_user_id, user_id)
+    db.session.commit()
+
+    # Only the latest page; older messages are fetched from chat_messages
+    messages, next_cursor = chat_history(current_user_id, user_id, limit=app.config['CHAT_PAGE_SIZE'])
 
-    return render_template('chat.html', other_user=other_user, messages=messages)
+    return render_template('chat.html', other_user=other_user, messages=messages, next_cursor=next_cursor)
+
+@app.route('/chat/<int:user_id>/messages')
+def chat_messages(user_id):
+    """JSON page of the messages before the `before` cursor, oldest first."""
+    if 'user_id' not in session:
+        return {'success': False}, 401
+    limit = max(1, min(request.args.get('limit', app.config['CHAT_PAGE_SIZE'], type=int), 200))
+    messages, next_cursor = chat_history(session['user_id'], user_id, cursor=request.args.get('before'), limit=limit)
+    return {
+        'success': True,
+        'messages': [message_event(message) for message in messages],
+        'next_cursor': next_cursor
+    }
+
+@app.route('/chat/stream/<int:user_id>')
+def chat_stream(user_id):
+    """Server-Sent Events stream of new messages between the current user and user_id.
+
+    Messages newer than ?after=<message id> (or the Last-Event-ID a
+    reconnecting browser sends) are replayed first, so nothing sent
+    between the page render and the connection is lost.
+    """
+    if 'user_id' not in session:
+        return {'success': False}, 401
+    current_user_id = session['user_id']
+    User.query.get_or_404(user_id)
+
+    subscription = chat_hub.subscribe(chat_channel(current_user_id, user_id))
+    after = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', type=int)
+    missed = []
+    if after:
+        missed = [message_event(message) for message in Message.query.filter(
+            (((Message.sender_id == current_user_id) & (Message.receiver_id == user_id)) |
+             ((Message.sender_id == user_id) & (Message.receiver_id == current_user_id))) &
+            (Message.id > after)
+        ).order_by(Message.id).all()]
+    keepalive = app.config['CHAT_STREAM_KEEPALIVE']
+
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            last_id = after or 0
+            for event in missed:
+                last_id = event['id']
+                yield f"id: {last_id}\ndata: {json.dumps(event)}\n\n"
+            while True:
+                payload = subscription.get(timeout=keepalive)
+                if payload is None:
+                    yield ': keepalive\n\n'
+                    continue
+                event_id = json.loads(payload)['id']
+                # Skip anything the replay already sent
+                if event_id > last_id:
+                    last_id = event_id
+                    yield f"id: {event_id}\ndata: {payload}\n\n"
+        finally:
+            subscription.close()
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/view_applications/<int:job_id>')
 def view_applications(job_id):
@@ -902,16 +1040,32 @@ def send_message_to_applicants(job_id):
         return redirect(url_for('jobs'))
 
     message_content = request.form['message']
-    applications = JobApplication.query.filter_by(job_id=job_id).all()
-
-    for application in applications:
-        message = Message(sender_id=session['user_id'], receiver_id=application.applicant_id, content=message_content)
-        db.session.add(message)
-
-    db.session.commit()
-    flash(f'Message sent to {len(applications)} applicants!')
+    applicant_ids = [applicant_id for (applicant_id,) in
+                     db.session.query(JobApplication.applicant_id).filter_by(job_id=job_id).distinct().all()]
+
+    sender = User.query.get(session['user_id'])
+    fanout_job_id = dispatch_fan_out(sender.id, applicant_ids, content=message_content, notification={
+        'type': 'message',
+        'title': 'New Message',
+        'message': f"{sender.username} sent you a message: {message_content[:50]}{'...' if len(message_content) > 50 else ''}",
+        'group_key': f'user:{sender.id}',
+        'summary': f'{sender.username} sent you {{count}} messages',
+    })
+    if fanout_job_id:
+        flash(f'Sending message to {len(applicant_ids)} applicants...')
+        return redirect(url_for('view_applications', job_id=job_id, fanout=fanout_job_id))
+    flash(f'Message sent to {len(applicant_ids)} applicants!')
     return redirect(url_for('view_applications', job_id=job_id))
 
+@app.route('/fanout_status/<job_id>')
+def fanout_status(job_id):
+    if 'user_id' not in session:
+        return {'success': False}, 401
+    status = fanout_worker.status(job_id, session['user_id'])
+    if status is None:
+        return {'success': False, 'error': 'Unknown job'}, 404
+    return {'success': True, **status}
+
 @app.route('/like_post/<int:post_id>', methods=['POST'])
 def like_post(post_id):
     if 'user_id' not in session:
@@ -922,15 +1076,17 @@ def like_post(post_id):
 
     if existing_like:
         db.session.delete(existing_like)
+        Post.query.filter_by(id=post_id).update({Post.like_count: Post.like_count - 1})
         db.session.commit()
         liked = False
     else:
         like = Like(user_id=user_id, post_id=post_id)
         db.session.add(like)
+        Post.query.filter_by(id=post_id).update({Post.like_count: Post.like_count + 1})
         db.session.commit()
         liked = True
 
-    like_count = Like.query.filter_by(post_id=post_id).count()
+    like_count = db.session.query(Post.like_count).filter_by(id=post_id).scalar() or 0
     return {'success': True, 'liked': liked, 'like_count': like_count}
 
 @app.route('/add_comment/<int:post_id>', methods=['POST'])
@@ -946,11 +1102,12 @@ def add_comment(post_id):
 
     comment = Comment(user_id=user_id, post_id=post_id, content=content.strip())
     db.session.add(comment)
-    db.session.commit()
+    Post.query.filter_by(id=post_id).update({Post.comment_count: Post.comment_count + 1})
 
     # Create activity
     post = Post.query.get(post_id)
     create_activity(user_id, 'comment_added', f'Commented on {post.user.username}\'s post')
+    db.session.commit()
 
     return {
         'success': True,
@@ -984,8 +1141,11 @@ def remove_connection(connection_id):
 
     connection = Connection.query.get(connection_id)
     if connection and (connection.sender_id == session['user_id'] or connection.receiver_id == session['user_id']):
+        was_accepted = connection.status == 'accepted'
         db.session.delete(connection)
         db.session.commit()
+        if was_accepted:
+            social_graph.remove_edge(connection.sender_id, connection.receiver_id)
         return {'success': True}
     return {'success': False}, 400
 
@@ -997,8 +1157,9 @@ def notifications():
     if not user:
         session.pop('user_id', None)
         return redirect(url_for('login'))
-    user_notifications = Notification.query.filter_by(user_id=user.id).order_by(Notification.created_at.desc()).all()
-    return render_template('notifications.html', user=user, notifications=user_notifications, format_datetime_ist=format_datetime_ist)
+    user_notifications, next_cursor = notifications_page(user.id, cursor=request.args.get('before'))
+    return render_template('notifications.html', user=user, notifications=user_notifications, next_cursor=next_cursor,
+                           format_datetime_ist=format_datetime_ist)
 
 @app.route('/mark_notification_read/<int:notification_id>', methods=['POST'])
 def mark_notification_read(notification_id):
@@ -1007,9 +1168,9 @@ def mark_notification_read(notification_id):
 
     notification = Notification.query.get(notification_id)
     if notification and notification.user_id == session['user_id']:
-        notification.is_read = True
+        mark_read(notification)
         db.session.commit()
-        return {'success': True}
+        return {'success': True, 'unread_count': unread_count(session['user_id'])}
     return {'success': False}, 404
 
 @app.route('/mark_all_notifications_read', methods=['POST'])
@@ -1017,9 +1178,9 @@ def mark_all_notifications_read():
     if 'user_id' not in session:
         return {'success': False}, 401
 
-    Notification.query.filter_by(user_id=session['user_id'], is_read=False).update({'is_read': True})
+    mark_all_read(session['user_id'])
     db.session.commit()
-    return {'success': True}
+    return {'success': True, 'unread_count': 0}
 
 @app.route('/delete_notification/<int:notification_id>', methods=['POST'])
 def delete_notification(notification_id):
@@ -1028,9 +1189,9 @@ def delete_notification(notification_id):
 
     notification = Notification.query.get(notification_id)
     if notification and notification.user_id == session['user_id']:
-        db.session.delete(notification)
+        remove_notification(notification)
         db.session.commit()
-        return {'success': True}
+        return {'success': True, 'unread_count': unread_count(session['user_id'])}
     return {'success': False}, 404
 
 @app.route('/logout')
@@ -1039,5 +1200,6 @@ def logout():
     return redirect(url_for('index'))
 
 if __name__ == '__main__':
+    start_background_jobs()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+import uuid
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.data[key]
+                return default
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            entry = self.data.pop(key, None)
+            return entry[1] if entry else None
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+class StampFile:
+    """A small file that processes replace to tell each other their in-memory copies are stale.
+
+    Readers remember stamp() from when they loaded and reload once it
+    differs; a writer calls touch() after committing its change.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def open(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            self.touch()
+
+    def stamp(self):
+        """Return the current file's identity, or None when there is no file."""
+        if self.path is None:
+            return None
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    def touch(self):
+        """Replace the file so other processes see a new inode; return its stamp."""
+        if self.path is None:
+            return None
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(uuid.uuid4().hex)
+            f.flush()
+            st = os.fstat(f.fileno())
+        os.replace(tmp_path, self.path)
+        return (st.st_ino, st.st_mtime_ns)
@@ -0,0 +1,97 @@
+from models import db, Message, Conversation
+from timeline import encode_cursor, decode_cursor
+
+def conversation_pair(user_id, other_id):
+    return min(user_id, other_id), max(user_id, other_id)
+
+def chat_channel(user_id, other_id):
+    """Pub/sub channel that carries new messages between two users."""
+    return 'chat:%d:%d' % conversation_pair(user_id, other_id)
+
+def message_event(message):
+    """JSON-ready form of a message, as sent to chat.html."""
+    return {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'receiver_id': message.receiver_id,
+        'content': message.content,
+        'media_type': message.media_type,
+        'media_path': message.media_path,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+def record_message(message):
+    """Update the conversation summary for a new message. The caller commits.
+
+    Moves the conversation's last message forward and bumps the
+    receiver's unread counter with an in-database increment.
+    """
+    db.session.flush()
+    user_a_id, user_b_id = conversation_pair(message.sender_id, message.receiver_id)
+    unread = Conversation.unread_a if message.receiver_id == user_a_id else Conversation.unread_b
+    updated = Conversation.query.filter_by(user_a_id=user_a_id, user_b_id=user_b_id).update({
+        Conversation.last_message_id: message.id,
+        Conversation.last_message_at: message.timestamp,
+        unread: unread + 1,
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(Conversation(
+            user_a_id=user_a_id, user_b_id=user_b_id,
+            last_message_id=message.id, last_message_at=message.timestamp,
+            unread_a=int(message.receiver_id == user_a_id),
+            unread_b=int(message.receiver_id != user_a_id),
+        ))
+
+def chat_history(user_id, other_id, cursor=None, limit=50):
+    """Return (messages oldest first, cursor for older messages) between two users.
+
+    Each direction of the pair is read newest first from
+    ix_message_pair_timestamp, keyed on (timestamp, id), and the two are
+    merged, so a page costs the same however long the thread is. The
+    cursor is None once the start of the thread is reached.
+    """
+    before = decode_cursor(cursor) if cursor else None
+    directions = [(user_id, other_id)] if user_id == other_id else [(user_id, other_id), (other_id, user_id)]
+    messages = []
+    for sender_id, receiver_id in directions:
+        query = Message.query.filter_by(sender_id=sender_id, receiver_id=receiver_id)
+        if before is not None:
+            query = query.filter((Message.timestamp < before[0]) | ((Message.timestamp == before[0]) & (Message.id < before[1])))
+        messages.extend(query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all())
+    messages.sort(key=lambda message: (message.timestamp, message.id), reverse=True)
+    page = messages[:limit]
+    next_cursor = encode_cursor(page[-1].timestamp, page[-1].id) if len(messages) > limit else None
+    page.reverse()
+    return page, next_cursor
+
+def mark_conversation_read(user_id, other_id):
+    """Mark everything other_id sent to user_id as read. The caller commits."""
+    Message.query.filter_by(sender_id=other_id, receiver_id=user_id, is_read=False).update(
+        {Message.is_read: True}, synchronize_session=False)
+    user_a_id, user_b_id = conversation_pair(user_id, other_id)
+    unread = Conversation.unread_a if user_id == user_a_id else Conversation.unread_b
+    Conversation.query.filter_by(user_a_id=user_a_id, user_b_id=user_b_id).update(
+        {unread: 0}, synchronize_session=False)
+
+def inbox(user_id):
+    """Return the user's conversations, newest first, as dicts for messages.html.
+
+    One indexed query, with the other user and the last message joined in.
+    """
+    rows = Conversation.query.options(
+        db.joinedload(Conversation.user_a),
+        db.joinedload(Conversation.user_b),
+        db.joinedload(Conversation.last_message),
+    ).filter(
+        ((Conversation.user_a_id == user_id) | (Conversation.user_b_id == user_id)) &
+        (Conversation.user_a_id != Conversation.user_b_id)
+    ).order_by(Conversation.last_message_at.desc()).all()
+    conversations = []
+    for conversation in rows:
+        is_a = conversation.user_a_id == user_id
+        conversations.append({
+            'user': conversation.user_b if is_a else conversation.user_a,
+            'latest_message': conversation.last_message,
+            'unread_count': conversation.unread_a if is_a else conversation.unread_b,
+        })
+    return conversations
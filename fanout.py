@@ -0,0 +1,156 @@
+from models import db, Message, Conversation, FanOutJob
+from conversations import conversation_pair
+from notifications import add_notifications, invalidate_unread
+from scores import bump_score, award_badges
+from metrics import record
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, insert, update
+import queue
+import threading
+import uuid
+
+CHUNK_SIZE = 500
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _insert_messages(connection, sender_id, recipient_ids, content):
+    """Insert one message per recipient; return [(message_id, receiver_id, timestamp)]."""
+    timestamp = datetime.utcnow()
+    rows = [{'sender_id': sender_id, 'receiver_id': receiver_id, 'content': content, 'timestamp': timestamp}
+            for receiver_id in recipient_ids]
+    result = connection.execute(
+        insert(Message.__table__).returning(Message.id, Message.receiver_id, sort_by_parameter_order=True), rows)
+    return [(message_id, receiver_id, timestamp) for message_id, receiver_id in result]
+
+def _record_conversations(connection, sender_id, messages):
+    """Bulk version of conversations.record_message for messages from one sender."""
+    conversation = Conversation.__table__
+    receiver_ids = [receiver_id for _, receiver_id, _ in messages]
+    existing = {}
+    for row in connection.execute(
+        conversation.select().with_only_columns(conversation.c.id, conversation.c.user_a_id, conversation.c.user_b_id).where(
+            ((conversation.c.user_a_id == sender_id) & conversation.c.user_b_id.in_(receiver_ids)) |
+            ((conversation.c.user_b_id == sender_id) & conversation.c.user_a_id.in_(receiver_ids))
+        )
+    ):
+        existing[(row.user_a_id, row.user_b_id)] = row.id
+    updates, inserts = [], []
+    for message_id, receiver_id, timestamp in messages:
+        user_a_id, user_b_id = conversation_pair(sender_id, receiver_id)
+        unread_a = int(receiver_id == user_a_id)
+        if (user_a_id, user_b_id) in existing:
+            updates.append({'conversation_id': existing[(user_a_id, user_b_id)], 'message_id': message_id,
+                            'message_at': timestamp, 'add_a': unread_a, 'add_b': 1 - unread_a})
+        else:
+            inserts.append({'user_a_id': user_a_id, 'user_b_id': user_b_id, 'last_message_id': message_id,
+                            'last_message_at': timestamp, 'unread_a': unread_a, 'unread_b': 1 - unread_a})
+    if updates:
+        connection.execute(
+            update(conversation).where(conversation.c.id == bindparam('conversation_id')).values(
+                last_message_id=bindparam('message_id'),
+                last_message_at=bindparam('message_at'),
+                unread_a=conversation.c.unread_a + bindparam('add_a'),
+                unread_b=conversation.c.unread_b + bindparam('add_b'),
+            ), updates)
+    if inserts:
+        connection.execute(insert(conversation), inserts)
+
+def fan_out(sender_id, recipient_ids, content=None, notification=None, chunk_size=CHUNK_SIZE, progress=None):
+    """Send a message and/or notification to many users with chunked executemany inserts.
+
+    notification is a dict with type, title, message and optionally
+    related_id, group_key and summary, coalesced like add_notification;
+    when a message is sent too, each notification's related_id is that
+    recipient's message. Each chunk is
+    committed on its own and progress(done, total) is called after it.
+    Returns the number of recipients reached.
+    """
+    recipient_ids = [recipient_id for recipient_id in dict.fromkeys(recipient_ids) if recipient_id != sender_id]
+    done = 0
+    for chunk in _chunks(recipient_ids, chunk_size):
+        connection = db.session.connection()
+        related_ids = {}
+        if content is not None:
+            messages = _insert_messages(connection, sender_id, chunk, content)
+            _record_conversations(connection, sender_id, messages)
+            record(connection, 'messages', len(messages))  # Core inserts skip the metrics listeners
+            related_ids = {receiver_id: message_id for message_id, receiver_id, _ in messages}
+            award_badges(sender_id, bump_score(sender_id, 'messages_count', len(messages)))
+        if notification is not None:
+            add_notifications(connection, chunk, notification['type'], notification['title'], notification['message'],
+                              related_ids=related_ids, related_id=notification.get('related_id'),
+                              group_key=notification.get('group_key'), summary=notification.get('summary'))
+        db.session.commit()
+        if notification is not None:
+            invalidate_unread(chunk)
+        done += len(chunk)
+        if progress is not None:
+            progress(done, len(recipient_ids))
+    return done
+
+class FanOutWorker:
+    """Runs large fan-outs one at a time on a background thread.
+
+    submit() records a FanOutJob row and returns its ID right away;
+    status(job_id) reports {state, done, total, error} from that row
+    while the job runs and for an hour after, from any worker process.
+    """
+
+    def __init__(self, keep=timedelta(hours=1)):
+        self.queue = queue.Queue()
+        self.keep = keep
+        self.app = None
+        self.lock = threading.Lock()
+
+    def start(self, app):
+        with self.lock:
+            if self.app is None:
+                self.app = app
+                threading.Thread(target=self.work, name='fan-out', daemon=True).start()
+
+    def submit(self, app, sender_id, recipient_ids, **kwargs):
+        """Queue a fan-out and commit its FanOutJob row; return the job ID."""
+        self.start(app)
+        job_id = uuid.uuid4().hex
+        FanOutJob.query.filter(FanOutJob.state.in_(('done', 'failed')),
+                               FanOutJob.created_at < datetime.utcnow() - self.keep).delete(synchronize_session=False)
+        db.session.add(FanOutJob(id=job_id, sender_id=sender_id, total=len(recipient_ids)))
+        db.session.commit()
+        self.queue.put((job_id, sender_id, list(recipient_ids), kwargs))
+        return job_id
+
+    def status(self, job_id, sender_id):
+        """Return the job's progress, or None if there is no such job from sender_id."""
+        job = FanOutJob.query.filter_by(id=job_id, sender_id=sender_id).first()
+        if job is None:
+            return None
+        return {'state': job.state, 'done': job.done, 'total': job.total, 'error': job.error}
+
+    def _update(self, job_id, **values):
+        FanOutJob.query.filter_by(id=job_id).update(values, synchronize_session=False)
+        db.session.commit()
+
+    def work(self):
+        while True:
+            job_id, sender_id, recipient_ids, kwargs = self.queue.get()
+            with self.app.app_context():
+                progress = {'done': 0}
+
+                def report(done, total):
+                    progress['done'] = done
+                    self._update(job_id, done=done, total=total)
+
+                try:
+                    self._update(job_id, state='running')
+                    fan_out(sender_id, recipient_ids, progress=report, **kwargs)
+                    self._update(job_id, state='done')
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.exception('Fan-out %s failed after %d recipients', job_id, progress['done'])
+                    self._update(job_id, state='failed', error=str(e))
+                finally:
+                    db.session.remove()
+
+fanout_worker = FanOutWorker()
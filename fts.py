@@ -0,0 +1,120 @@
+from models import db, Post, Job, Event, Question, Answer
+from index import tokenize
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+FTS_TABLE = 'content_fts'
+
+# entity name, rowid code, (title, body) extractor
+FTS_SOURCES = {
+    Post: ('post', 1, lambda post: ('', post.content)),
+    Job: ('job', 2, lambda job: (job.title, job.description)),
+    Event: ('event', 3, lambda ev: (ev.title, f'{ev.description} {ev.location or ""}')),
+    Question: ('question', 4, lambda question: (question.title, question.content)),
+    Answer: ('answer', 5, lambda answer: ('', answer.content)),
+}
+ENTITY_CODES = {code: name for name, code, _ in FTS_SOURCES.values()}
+ROWID_STRIDE = 8
+
+_enabled = False
+
+def fts_enabled():
+    return _enabled
+
+def _rowid(code, entity_id):
+    # Encode entity type into the rowid so updates and deletes are rowid lookups
+    return entity_id * ROWID_STRIDE + code
+
+def _index_row(connection, model, target):
+    _, code, extract = FTS_SOURCES[model]
+    title, body = extract(target)
+    connection.execute(
+        text(f'INSERT INTO {FTS_TABLE}(rowid, title, body, user_id) VALUES (:rowid, :title, :body, :user_id)'),
+        {'rowid': _rowid(code, target.id), 'title': title or '', 'body': body or '', 'user_id': target.user_id},
+    )
+
+def _delete_row(connection, model, target):
+    _, code, _ = FTS_SOURCES[model]
+    connection.execute(text(f'DELETE FROM {FTS_TABLE} WHERE rowid = :rowid'), {'rowid': _rowid(code, target.id)})
+
+def _register_listeners():
+    for model in FTS_SOURCES:
+        def after_insert(mapper, connection, target, model=model):
+            if _enabled:
+                _index_row(connection, model, target)
+
+        def after_update(mapper, connection, target, model=model):
+            if _enabled:
+                _delete_row(connection, model, target)
+                _index_row(connection, model, target)
+
+        def after_delete(mapper, connection, target, model=model):
+            if _enabled:
+                _delete_row(connection, model, target)
+
+        event.listen(model, 'after_insert', after_insert)
+        event.listen(model, 'after_update', after_update)
+        event.listen(model, 'after_delete', after_delete)
+
+def rebuild_fts():
+    """Re-index every post, job, event, question and answer."""
+    db.session.execute(text(f'DELETE FROM {FTS_TABLE}'))
+    connection = db.session.connection()
+    for model in FTS_SOURCES:
+        for target in model.query.yield_per(500):
+            _index_row(connection, model, target)
+    db.session.commit()
+
+def init_fts(app):
+    """Create the FTS5 table and start syncing it, if the database supports it.
+
+    Must run inside an app context. Disabled when SEARCH_FTS_ENABLED is
+    False, the database is not SQLite, or SQLite was built without FTS5.
+    """
+    global _enabled
+    if not app.config.get('SEARCH_FTS_ENABLED', True) or db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "title, body, user_id UNINDEXED, tokenize='porter unicode61')"
+        ))
+        db.session.commit()
+    except OperationalError:
+        db.session.rollback()
+        print('SQLite FTS5 is not available; content search is disabled.')
+        return False
+    if not _enabled:
+        _register_listeners()
+    _enabled = True
+    if db.session.execute(text(f'SELECT count(*) FROM {FTS_TABLE}')).scalar() == 0:
+        rebuild_fts()
+    return True
+
+def search_content(query, limit=15, offset=0):
+    """Full-text search posts, jobs, events, questions and answers.
+
+    Returns (hits, total) where each hit is a dict with type, id, user_id,
+    title and snippet, ranked by FTS5's bm25 with titles weighted higher.
+    """
+    tokens = tokenize(query)
+    if not _enabled or not tokens:
+        return [], 0
+    match = ' OR '.join(f'"{token}"' for token in tokens)
+    total = db.session.execute(
+        text(f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match'), {'match': match}
+    ).scalar()
+    rows = db.session.execute(text(
+        f"SELECT rowid, user_id, title, snippet({FTS_TABLE}, 1, '', '', '...', 24) FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH :match ORDER BY bm25({FTS_TABLE}, 4.0, 1.0) LIMIT :limit OFFSET :offset"
+    ), {'match': match, 'limit': limit, 'offset': offset}).all()
+    hits = []
+    for rowid, user_id, title, snippet in rows:
+        hits.append({
+            'type': ENTITY_CODES[rowid % ROWID_STRIDE],
+            'id': rowid // ROWID_STRIDE,
+            'user_id': user_id,
+            'title': title,
+            'snippet': snippet,
+        })
+    return hits, total
@@ -0,0 +1,117 @@
+from models import db, Connection
+from cache import StampFile
+from array import array
+from bisect import bisect_left
+from collections import Counter
+import threading
+import time
+
+class SocialGraph:
+    """In-memory adjacency index of accepted connections.
+
+    Each user's neighbours are a sorted array('I'). Call open() (or
+    build()) at startup and add_edge()/remove_edge() after a connection
+    is accepted or removed. Those also replace a small stamp file, and
+    other worker processes rebuild on their next read once the stamp has
+    changed, so an accepted connection shows up everywhere on the next
+    request. Connections changed outside the app (e.g. by hand in the
+    database) are picked up once the graph is older than max_age seconds.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.adjacency = {}
+        self.built_at = None
+        self.stamp_file = StampFile()
+        self.stamp = None
+        self.lock = threading.RLock()
+
+    def open(self, stamp_path):
+        """Build the graph and follow other processes' edge changes through stamp_path."""
+        self.stamp_file.open(stamp_path)
+        self.build()
+
+    def build(self):
+        """(Re)build the graph from accepted connections."""
+        # Read before querying, so a change committed during the build triggers another one
+        stamp = self.stamp_file.stamp()
+        rows = db.session.query(Connection.sender_id, Connection.receiver_id).filter(
+            Connection.status == 'accepted'
+        ).all()
+        neighbours = {}
+        for sender_id, receiver_id in rows:
+            if sender_id == receiver_id:
+                continue
+            neighbours.setdefault(sender_id, set()).add(receiver_id)
+            neighbours.setdefault(receiver_id, set()).add(sender_id)
+        with self.lock:
+            self.adjacency = {user_id: array('I', sorted(ids)) for user_id, ids in neighbours.items()}
+            self.built_at = time.monotonic()
+            self.stamp = stamp
+
+    def _ensure_fresh(self):
+        if (self.built_at is None or time.monotonic() - self.built_at > self.max_age
+                or self.stamp_file.stamp() != self.stamp):
+            self.build()
+
+    def _insert(self, user_id, other_id):
+        ids = self.adjacency.setdefault(user_id, array('I'))
+        i = bisect_left(ids, other_id)
+        if i == len(ids) or ids[i] != other_id:
+            ids.insert(i, other_id)
+
+    def _delete(self, user_id, other_id):
+        ids = self.adjacency.get(user_id)
+        if ids is None:
+            return
+        i = bisect_left(ids, other_id)
+        if i < len(ids) and ids[i] == other_id:
+            del ids[i]
+            if not ids:
+                del self.adjacency[user_id]
+
+    def add_edge(self, user_id, other_id):
+        if user_id == other_id:
+            return
+        with self.lock:
+            self._ensure_fresh()
+            self._insert(user_id, other_id)
+            self._insert(other_id, user_id)
+            self.stamp = self.stamp_file.touch()
+
+    def remove_edge(self, user_id, other_id):
+        with self.lock:
+            self._ensure_fresh()
+            self._delete(user_id, other_id)
+            self._delete(other_id, user_id)
+            self.stamp = self.stamp_file.touch()
+
+    def neighbours(self, user_id):
+        """Return the sorted IDs of a user's connections."""
+        self._ensure_fresh()
+        with self.lock:
+            return array('I', self.adjacency.get(user_id, ()))
+
+    def second_degree(self, user_id):
+        """Return a Counter of friends-of-friends -> number of mutual connections.
+
+        Excludes the user and their direct connections.
+        """
+        direct = self.neighbours(user_id)
+        counts = Counter()
+        with self.lock:
+            for friend_id in direct:
+                counts.update(self.adjacency.get(friend_id, ()))
+        counts.pop(user_id, None)
+        for friend_id in direct:
+            counts.pop(friend_id, None)
+        return counts
+
+    def recommend(self, user_id, limit=10, exclude=()):
+        """Return [(user_id, mutual count)] of people user_id may know, best first."""
+        counts = self.second_degree(user_id)
+        for other_id in exclude:
+            counts.pop(other_id, None)
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+social_graph = SocialGraph()
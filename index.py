@@ -1,6 +1,25 @@
 from models import User
-from collections import defaultdict
+from cache import TTLCache
+from sqlalchemy import func
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import heapq
+import json
+import math
+import mmap
+import os
 import re
+import struct
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: snapshot writers are not coordinated across processes
+    fcntl = None
 
 def tokenize(text):
     """Tokenize text into lowercase words."""
@@ -8,59 +27,757 @@ def tokenize(text):
         return []
     return re.findall(r'\b\w+\b', text.lower())
 
-def build_inverted_index():
-    """Build inverted index for all users."""
-    inverted_index = defaultdict(list)
-    users = User.query.all()
-    for user in users:
-        user_id = user.id
-        # Index batch_year
-        if user.batch_year:
-            inverted_index[str(user.batch_year)].append(user_id)
-        # Index skills
-        if user.skills:
-            skills = tokenize(user.skills)
-            for skill in skills:
-                inverted_index[skill].append(user_id)
-        # Index role
-        inverted_index[user.role].append(user_id)
-        # Index username (tokenized for name search)
-        if user.username:
-            name_tokens = tokenize(user.username)
-            for token in name_tokens:
-                inverted_index[token].append(user_id)
-    return inverted_index
-
-def search_inverted_index(query, inverted_index):
-    """Search the inverted index with a query."""
-    tokens = tokenize(query)
-    if not tokens:
-        return set()
-    # Use union (OR) instead of intersection (AND) for better search results
-    result_sets = [set(inverted_index.get(token, [])) for token in tokens]
-    if result_sets:
-        results = set()
-        for s in result_sets:
-            results |= s
-        return results
-    return set()
-
-# For ranking, perhaps sort by number of matches or something simple.
-
-def rank_results(results, query, inverted_index):
-    """Rank results based on relevance."""
-    tokens = tokenize(query)
-    ranked = []
-    for user_id in results:
-        score = 0
-        for token in tokens:
-            if user_id in inverted_index.get(token, []):
-                # Give higher weight to exact matches
-                score += 2
-            # Check for partial matches in skills or names
-            for key, user_ids in inverted_index.items():
-                if token.lower() in key.lower() and user_id in user_ids:
-                    score += 1
-        ranked.append((user_id, score))
-    ranked.sort(key=lambda x: x[1], reverse=True)
-    return [uid for uid, _ in ranked]
\ No newline at end of file
+def user_tokens(user):
+    """Return the index tokens for a single user."""
+    tokens = []
+    # Index batch_year
+    if user.batch_year:
+        tokens.append(str(user.batch_year))
+    # Index skills
+    if user.skills:
+        tokens.extend(tokenize(user.skills))
+    # Index role
+    tokens.append(user.role)
+    # Index username (tokenized for name search)
+    if user.username:
+        tokens.extend(tokenize(user.username))
+    return tokens
+
+def user_facets(user):
+    """Return the (facet, value) pairs a user can be filtered on."""
+    facets = [('role', user.role)]
+    if user.batch_year:
+        facets.append(('batch_year', str(user.batch_year)))
+    if user.skills:
+        for skill in user.skills.split(','):
+            skill = ' '.join(tokenize(skill))
+            if skill:
+                facets.append(('skill', skill))
+    return facets
+
+def iter_bits(bits):
+    """Yield the positions of the set bits in an int bitset, lowest first."""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+class SubstringIndex:
+    """N-gram index over the vocabulary for substring lookups.
+
+    Every key is indexed under all of its 1- to 3-grams, so the keys
+    containing a token are found by intersecting a few gram sets instead
+    of scanning the whole vocabulary.
+    """
+
+    GRAM_SIZE = 3
+
+    def __init__(self, keys=()):
+        self.grams = defaultdict(set)
+        for key in keys:
+            self.add_key(key)
+
+    def _key_grams(self, key):
+        key = key.lower()
+        grams = set()
+        for n in range(1, self.GRAM_SIZE + 1):
+            for i in range(len(key) - n + 1):
+                grams.add(key[i:i + n])
+        return grams
+
+    def add_key(self, key):
+        for gram in self._key_grams(key):
+            self.grams[gram].add(key)
+
+    def remove_key(self, key):
+        for gram in self._key_grams(key):
+            keys = self.grams.get(gram)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self.grams[gram]
+
+    def lookup(self, token):
+        """Return the vocabulary keys that contain token."""
+        token = token.lower()
+        if not token:
+            return set()
+        if len(token) <= self.GRAM_SIZE:
+            return set(self.grams.get(token, ()))
+        n = self.GRAM_SIZE
+        candidate_sets = [self.grams.get(token[i:i + n]) for i in range(len(token) - n + 1)]
+        if not all(candidate_sets):
+            return set()
+        candidate_sets.sort(key=len)
+        candidates = candidate_sets[0]
+        for keys in candidate_sets[1:]:
+            candidates = candidates & keys
+            if not candidates:
+                return set()
+        # Grams only narrow the set down; confirm the actual substring
+        return {key for key in candidates if token in key.lower()}
+
+def edit_distance(a, b, max_dist):
+    """Optimal string alignment distance between a and b.
+
+    Gives up early and returns max_dist + 1 once the distance is known to
+    exceed max_dist. Adjacent transpositions count as one edit.
+    """
+    if abs(len(a) - len(b)) > max_dist:
+        return max_dist + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, prev2[j - 2] + 1)
+            cur[j] = value
+        if min(cur) > max_dist:
+            return max_dist + 1
+        prev2, prev = prev, cur
+    return min(prev[-1], max_dist + 1)
+
+class FuzzyIndex:
+    """Trigram index over the vocabulary for typo-tolerant lookups.
+
+    Keys are indexed by padded trigrams. A misspelled token only gets
+    verified with edit_distance() against keys that share enough trigrams
+    with it, so lookups stay in the low milliseconds.
+    """
+
+    MIN_LENGTH = 4
+
+    def __init__(self, keys=()):
+        self.grams = defaultdict(set)
+        for key in keys:
+            self.add_key(key)
+
+    @staticmethod
+    def _grams(key):
+        padded = f'$${key.lower()}$$'
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    @classmethod
+    def max_distance(cls, token):
+        if len(token) < cls.MIN_LENGTH or token.isdigit():
+            return 0
+        return 1 if len(token) < 6 else 2
+
+    def add_key(self, key):
+        # Keys one character shorter than MIN_LENGTH can still be a typo's target
+        if len(key) >= self.MIN_LENGTH - 1:
+            for gram in self._grams(key):
+                self.grams[gram].add(key)
+
+    def remove_key(self, key):
+        for gram in self._grams(key):
+            keys = self.grams.get(gram)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self.grams[gram]
+
+    def lookup(self, token):
+        """Return [(key, distance)] for the closest keys within the token's edit budget."""
+        token = token.lower()
+        max_dist = self.max_distance(token)
+        if not max_dist:
+            return []
+        grams = self._grams(token)
+        shared = Counter()
+        for gram in grams:
+            for key in self.grams.get(gram, ()):
+                shared[key] += 1
+        matches = []
+        for key, count in shared.items():
+            # Each edit touches at most three trigrams, a transposition six
+            if count < max(len(grams), len(key) + 2) - 6 * max_dist:
+                continue
+            dist = edit_distance(token, key.lower(), max_dist)
+            if 0 < dist <= max_dist:
+                matches.append((key, dist))
+        if not matches:
+            return []
+        best = min(dist for _, dist in matches)
+        return [(key, dist) for key, dist in matches if dist == best]
+
+class FacetIndex:
+    """Bitsets of user IDs per facet value, held as Python ints.
+
+    Bit n is set when user n has the value, so filters combine with & and
+    facet counts are popcounts.
+    """
+
+    def __init__(self, bitmaps=None):
+        self.bitmaps = bitmaps or {}
+        # user ID -> facet keys; derived from the bitmaps on first removal
+        # when loaded from a snapshot
+        self.user_keys = None if bitmaps else {}
+
+    def _keys_by_user(self):
+        if self.user_keys is None:
+            self.user_keys = defaultdict(list)
+            for key, bits in self.bitmaps.items():
+                for user_id in iter_bits(bits):
+                    self.user_keys[user_id].append(key)
+            self.user_keys = dict(self.user_keys)
+        return self.user_keys
+
+    def add(self, user_id, facets):
+        bit = 1 << user_id
+        for key in facets:
+            self.bitmaps[key] = self.bitmaps.get(key, 0) | bit
+        keys = self._keys_by_user()
+        keys[user_id] = list(dict.fromkeys(keys.get(user_id, []) + list(facets)))
+
+    def remove(self, user_id):
+        for key in self._keys_by_user().pop(user_id, ()):
+            bits = self.bitmaps.get(key, 0) & ~(1 << user_id)
+            if bits:
+                self.bitmaps[key] = bits
+            else:
+                self.bitmaps.pop(key, None)
+
+    def select(self, role=None, year_from=None, year_to=None, skills=()):
+        """Return the bitset of users passing every given filter, or None if no filter is set."""
+        selected = None
+
+        def narrow(current, bits):
+            return bits if current is None else current & bits
+
+        if role:
+            selected = narrow(selected, self.bitmaps.get(('role', role), 0))
+        if year_from is not None or year_to is not None:
+            year_bits = 0
+            for (facet, value), bits in self.bitmaps.items():
+                if facet != 'batch_year' or not value.isdigit():
+                    continue
+                year = int(value)
+                if (year_from is None or year >= year_from) and (year_to is None or year <= year_to):
+                    year_bits |= bits
+            selected = narrow(selected, year_bits)
+        for skill in skills:
+            selected = narrow(selected, self.bitmaps.get(('skill', ' '.join(tokenize(skill))), 0))
+        return selected
+
+    def counts(self, bits, limit=15):
+        """Return {facet: [(value, count)]} for the users in bits, largest counts first."""
+        counts = defaultdict(list)
+        for (facet, value), facet_bits in self.bitmaps.items():
+            count = (facet_bits & bits).bit_count()
+            if count:
+                counts[facet].append((value, count))
+        for facet, values in counts.items():
+            values.sort(key=lambda item: (-item[1], item[0]))
+            del values[limit:]
+        return dict(counts)
+
+class Postings:
+    """Sorted user IDs with their term frequencies, stored as compact arrays.
+
+    The arrays may be read-only views into a mapped snapshot; they are
+    copied into private arrays on the first write.
+    """
+
+    __slots__ = ('doc_ids', 'tfs')
+
+    def __init__(self, doc_ids=None, tfs=None):
+        self.doc_ids = array('I') if doc_ids is None else doc_ids
+        self.tfs = array('I') if tfs is None else tfs
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        return zip(self.doc_ids, self.tfs)
+
+    def __contains__(self, doc_id):
+        i = bisect_left(self.doc_ids, doc_id)
+        return i < len(self.doc_ids) and self.doc_ids[i] == doc_id
+
+    def _own(self):
+        if not isinstance(self.doc_ids, array):
+            self.doc_ids = array('I', self.doc_ids)
+            self.tfs = array('I', self.tfs)
+
+    def add(self, doc_id, tf):
+        self._own()
+        i = bisect_left(self.doc_ids, doc_id)
+        if i < len(self.doc_ids) and self.doc_ids[i] == doc_id:
+            self.tfs[i] = tf
+        else:
+            self.doc_ids.insert(i, doc_id)
+            self.tfs.insert(i, tf)
+
+    def remove(self, doc_id):
+        self._own()
+        i = bisect_left(self.doc_ids, doc_id)
+        if i < len(self.doc_ids) and self.doc_ids[i] == doc_id:
+            del self.doc_ids[i]
+            del self.tfs[i]
+
+# Snapshot layout: header, then little-endian uint32 arrays
+#   doc_ids[D] doc_lengths[D] term_offsets[T+1] postings_offsets[T+1]
+#   postings_doc_ids[P] postings_tfs[P] facet_offsets[F+1]
+# followed by the UTF-8 vocabulary blob that term_offsets point into, the
+# UTF-8 "facet\0value" blob for facet_offsets, and F facet bitmaps of W bytes.
+SNAPSHOT_MAGIC = b'ALNSRCH\0'
+SNAPSHOT_VERSION = 3
+# magic, version, generation, doc count, term count, postings count, total length,
+# facet count, facet bitmap width, watermark (latest User.updated_at indexed, in
+# microseconds since the epoch, 0 if unknown)
+SNAPSHOT_HEADER = struct.Struct('<8sIQIIIQIIQ')
+EPOCH = datetime(1970, 1, 1)
+
+class SearchIndex:
+    """Long-lived user search index, built once and updated in place.
+
+    Call build() or open() at startup and add_user()/remove_user() from
+    the write paths that change indexed fields, so searches only do
+    posting lookups. Matches are scored with BM25; partial (substring)
+    matches on other vocabulary terms count at PARTIAL_WEIGHT of an exact
+    match. Tokens with no exact match fall back to misspelling-tolerant
+    matches worth FUZZY_WEIGHT divided by their edit distance.
+
+    With open(path) the index is also kept on disk as a binary snapshot
+    plus an append-only update log, so worker processes start from the
+    snapshot instead of rebuilding from the user table. The postings are
+    read-only views of the mapped snapshot; the vocabulary dicts and gram
+    indexes are built per process when it loads. Each add_user() or
+    remove_user() appends one log entry that the other processes replay
+    on their next search. Every LOG_COMPACT_ENTRIES entries the writer
+    folds the log into a new snapshot, which the others then reload.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    PARTIAL_WEIGHT = 0.5
+    FUZZY_WEIGHT = 0.6
+    LOG_COMPACT_ENTRIES = 500
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_lengths = {}
+        self.doc_terms = {}  # user ID -> indexed terms, so removal only touches those postings
+        self.total_length = 0
+        self.substrings = SubstringIndex()
+        self.fuzzy = FuzzyIndex()
+        self.facets = FacetIndex()
+        # Ranked ID lists keyed by normalized query; dropped on any user change
+        self.results = TTLCache(maxsize=256, ttl=300)
+        self.lock = threading.RLock()
+        self.snapshot_path = None
+        self.snapshot_stamp = None
+        self.generation = 0
+        self.watermark = None  # latest User.updated_at reflected in the index
+        self.log_offset = 0  # bytes of the update log already applied
+        self.log_stamp = None
+        self.log_entries = 0
+
+    def build(self):
+        """(Re)build the index from the user table."""
+        with self.lock, self._snapshot_lock():
+            self.postings = {}
+            self.doc_lengths = {}
+            self.doc_terms = {}
+            self.total_length = 0
+            self.substrings = SubstringIndex()
+            self.fuzzy = FuzzyIndex()
+            self.facets = FacetIndex()
+            self.watermark = None
+            for user in User.query.all():
+                self._add(user.id, user_tokens(user), user_facets(user))
+                self._advance_watermark(user.updated_at)
+            self.results.clear()
+            self._write_snapshot()
+
+    def open(self, path):
+        """Load the snapshot at path, or build the index and write it there.
+
+        A snapshot for a different set of users is rebuilt. Users edited
+        after its watermark (the latest User.updated_at it reflects), e.g.
+        by a process that stopped before indexing them, are re-indexed.
+        """
+        with self.lock:
+            self.snapshot_path = path
+            if self._load_snapshot():
+                self._replay_log()
+                count, max_id = User.query.with_entities(func.count(User.id), func.max(User.id)).one()
+                doc_ids = self.doc_lengths.keys()
+                if count == len(doc_ids) and (max_id or 0) == max(doc_ids, default=0):
+                    self._catch_up()
+                    return
+            self.build()
+
+    def _catch_up(self):
+        query = User.query.filter(User.updated_at.isnot(None))
+        if self.watermark is not None:
+            query = query.filter(User.updated_at > self.watermark)
+        changed = query.all()
+        if not changed:
+            return
+        with self._snapshot_lock():
+            self._refresh()
+            for user in changed:
+                self._remove(user.id)
+                self._add(user.id, user_tokens(user), user_facets(user))
+                self._advance_watermark(user.updated_at)
+            self.results.clear()
+            self._write_snapshot()
+
+    def _advance_watermark(self, updated_at):
+        if updated_at is not None and (self.watermark is None or updated_at > self.watermark):
+            self.watermark = updated_at
+
+    def _add(self, user_id, tokens, facets):
+        self.facets.add(user_id, facets)
+        terms = Counter(tokens)
+        self.doc_lengths[user_id] = len(tokens)
+        self._doc_terms()[user_id] = tuple(terms)
+        self.total_length += len(tokens)
+        for term, tf in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = Postings()
+                self.substrings.add_key(term)
+                self.fuzzy.add_key(term)
+            postings.add(user_id, tf)
+
+    def _remove(self, user_id):
+        if user_id not in self.doc_lengths:
+            return
+        self.total_length -= self.doc_lengths.pop(user_id)
+        self.facets.remove(user_id)
+        for term in self._doc_terms().pop(user_id, ()):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.remove(user_id)
+            if not postings:
+                del self.postings[term]
+                self.substrings.remove_key(term)
+                self.fuzzy.remove_key(term)
+
+    def _doc_terms(self):
+        # Not stored in the snapshot; derived from the postings on first use after a load
+        if self.doc_terms is None:
+            doc_terms = defaultdict(list)
+            for term, postings in self.postings.items():
+                for doc_id in postings.doc_ids:
+                    doc_terms[doc_id].append(term)
+            self.doc_terms = dict(doc_terms)
+        return self.doc_terms
+
+    def remove_user(self, user_id):
+        """Drop a user's postings from the index."""
+        with self.lock, self._snapshot_lock():
+            self._refresh()
+            self._remove(user_id)
+            self.results.clear()
+            self._log({'op': 'remove', 'id': user_id})
+
+    def add_user(self, user):
+        """Index a new user, or re-index one whose fields changed."""
+        with self.lock, self._snapshot_lock():
+            self._refresh()
+            tokens, facets = user_tokens(user), user_facets(user)
+            self._remove(user.id)
+            self._add(user.id, tokens, facets)
+            self._advance_watermark(user.updated_at)
+            self.results.clear()
+            self._log({'op': 'add', 'id': user.id, 'tokens': tokens, 'facets': facets,
+                       'updated_at': user.updated_at.isoformat() if user.updated_at else None})
+
+    @contextmanager
+    def _snapshot_lock(self):
+        # Serializes snapshot writers across processes where flock exists
+        if fcntl is None or self.snapshot_path is None:
+            yield
+            return
+        with open(self.snapshot_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _log(self, entry):
+        """Record a change for the other processes, compacting the log when it is long."""
+        if self.snapshot_path is None:
+            return
+        if self.log_entries < self.LOG_COMPACT_ENTRIES or not self._write_snapshot():
+            self._append_log(entry)
+
+    def _append_log(self, entry):
+        with open(self.snapshot_path + '.log', 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+            self.log_offset = f.tell()
+        self.log_entries += 1
+        self.log_stamp = self._stat_stamp('.log')
+
+    def _reset_log(self):
+        """Start an empty update log for the current snapshot generation."""
+        log_path = self.snapshot_path + '.log'
+        tmp_path = f'{log_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'generation': self.generation}) + '\n')
+            self.log_offset = f.tell()
+        os.replace(tmp_path, log_path)
+        self.log_entries = 0
+        self.log_stamp = self._stat_stamp('.log')
+
+    def _replay_log(self):
+        """Apply the log entries other processes appended since we last read it.
+
+        A log whose header names another snapshot generation is skipped;
+        it belongs to a snapshot this process has not loaded (yet).
+        """
+        stamp = self._stat_stamp('.log')
+        if stamp is None or stamp == self.log_stamp:
+            return
+        try:
+            with open(self.snapshot_path + '.log', 'rb') as f:
+                header = f.readline()
+                if not header.endswith(b'\n') or json.loads(header).get('generation') != self.generation:
+                    return
+                start = max(self.log_offset, len(header))
+                f.seek(start)
+                data = f.read()
+        except (OSError, ValueError):
+            return
+        # Only whole lines; a writer may be midway through appending one
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            entry = json.loads(line)
+            self._remove(entry['id'])
+            if entry['op'] == 'add':
+                self._add(entry['id'], entry['tokens'], [tuple(facet) for facet in entry['facets']])
+                if entry.get('updated_at'):
+                    self._advance_watermark(datetime.fromisoformat(entry['updated_at']))
+            self.log_entries += 1
+        if end:
+            self.results.clear()
+        self.log_offset = start + end
+        self.log_stamp = stamp if end == len(data) else None
+
+    def _write_snapshot(self):
+        """Write the whole index as a new snapshot generation and start a fresh log. Returns False on failure."""
+        if self.snapshot_path is None:
+            return False
+        terms = sorted(self.postings)
+        blob = bytearray()
+        term_offsets = array('I', [0])
+        postings_offsets = array('I', [0])
+        postings_doc_ids = array('I')
+        postings_tfs = array('I')
+        for term in terms:
+            blob += term.encode('utf-8')
+            term_offsets.append(len(blob))
+            postings = self.postings[term]
+            postings_doc_ids.extend(postings.doc_ids)
+            postings_tfs.extend(postings.tfs)
+            postings_offsets.append(len(postings_doc_ids))
+        doc_ids = array('I', sorted(self.doc_lengths))
+        doc_lengths = array('I', (self.doc_lengths[doc_id] for doc_id in doc_ids))
+        facet_keys = sorted(self.facets.bitmaps)
+        facet_blob = bytearray()
+        facet_offsets = array('I', [0])
+        for facet, value in facet_keys:
+            facet_blob += f'{facet}\0{value}'.encode('utf-8')
+            facet_offsets.append(len(facet_blob))
+        facet_width = (max(self.facets.bitmaps.values(), default=0).bit_length() + 7) // 8
+        arrays = [doc_ids, doc_lengths, term_offsets, postings_offsets, postings_doc_ids, postings_tfs, facet_offsets]
+        if sys.byteorder != 'little':
+            for values in arrays:
+                values.byteswap()
+        self.generation += 1
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.generation,
+                                      len(doc_ids), len(terms), len(postings_doc_ids), self.total_length,
+                                      len(facet_keys), facet_width,
+                                      (self.watermark - EPOCH) // timedelta(microseconds=1) if self.watermark else 0)
+        tmp_path = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            for values in arrays:
+                values.tofile(f)
+            f.write(blob)
+            f.write(facet_blob)
+            for key in facet_keys:
+                f.write(self.facets.bitmaps[key].to_bytes(facet_width, 'little'))
+        try:
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            # e.g. Windows refuses to replace a mapped file; the in-memory index is still current
+            print(f'Could not replace search index snapshot: {e}')
+            os.remove(tmp_path)
+            self.generation -= 1
+            return False
+        self.snapshot_stamp = self._stat_stamp()
+        self._reset_log()
+        return True
+
+    def _stat_stamp(self, suffix=''):
+        try:
+            st = os.stat(self.snapshot_path + suffix)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load_snapshot(self):
+        """Map the snapshot file and adopt it as the index. Returns False if unusable."""
+        if sys.byteorder != 'little':
+            return False
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        if len(mapped) < SNAPSHOT_HEADER.size:
+            return False
+        (magic, version, generation, doc_count, term_count, postings_count, total_length,
+         facet_count, facet_width, watermark) = SNAPSHOT_HEADER.unpack_from(mapped)
+        arrays_size = 4 * (2 * doc_count + 2 * (term_count + 1) + 2 * postings_count + facet_count + 1)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or len(mapped) < SNAPSHOT_HEADER.size + arrays_size:
+            return False
+        view = memoryview(mapped)
+        pos = SNAPSHOT_HEADER.size
+        sections = []
+        for count in (doc_count, doc_count, term_count + 1, term_count + 1, postings_count, postings_count, facet_count + 1):
+            sections.append(view[pos:pos + 4 * count].cast('I'))
+            pos += 4 * count
+        doc_ids, doc_lengths, term_offsets, postings_offsets, postings_doc_ids, postings_tfs, facet_offsets = sections
+        blob = bytes(view[pos:pos + term_offsets[term_count]])
+        pos += term_offsets[term_count]
+        facet_blob = bytes(view[pos:pos + facet_offsets[facet_count]])
+        pos += facet_offsets[facet_count]
+        if len(mapped) < pos + facet_count * facet_width:
+            return False
+        bitmaps = {}
+        for i in range(facet_count):
+            facet, value = facet_blob[facet_offsets[i]:facet_offsets[i + 1]].decode('utf-8').split('\0', 1)
+            bitmaps[(facet, value)] = int.from_bytes(view[pos:pos + facet_width], 'little')
+            pos += facet_width
+        facets = FacetIndex(bitmaps)
+        postings = {}
+        for i in range(term_count):
+            term = blob[term_offsets[i]:term_offsets[i + 1]].decode('utf-8')
+            start, end = postings_offsets[i], postings_offsets[i + 1]
+            postings[term] = Postings(postings_doc_ids[start:end], postings_tfs[start:end])
+        self.postings = postings
+        self.doc_lengths = dict(zip(doc_ids, doc_lengths))
+        self.doc_terms = None
+        self.total_length = total_length
+        self.substrings = SubstringIndex(postings)
+        self.fuzzy = FuzzyIndex(postings)
+        self.facets = facets
+        self.generation = generation
+        self.watermark = EPOCH + timedelta(microseconds=watermark) if watermark else None
+        self.snapshot_stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        self.log_offset = 0
+        self.log_stamp = None
+        self.log_entries = 0
+        self.results.clear()
+        return True
+
+    def _refresh(self):
+        """Catch up with other processes: reload a replaced snapshot, then replay new log entries."""
+        if self.snapshot_path is None:
+            return
+        if self._stat_stamp() != self.snapshot_stamp:
+            self._load_snapshot()
+        self._replay_log()
+
+    def _accumulate(self, scores, postings, weight, avgdl, only_existing=False):
+        """Add the BM25 contribution of one term's postings to scores."""
+        n = len(self.doc_lengths)
+        df = len(postings)
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for doc_id, tf in postings:
+            if only_existing and doc_id not in scores:
+                continue
+            dl = self.doc_lengths[doc_id]
+            norm = tf + self.K1 * (1 - self.B + self.B * dl / avgdl)
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight * idf * tf * (self.K1 + 1) / norm
+
+    def search(self, query, limit=None, filters=None):
+        """Return (ranked user IDs, total matches) for the query.
+
+        Users matching any query token exactly are candidates. With a
+        limit, only the best `limit` IDs are returned, picked from a
+        bounded heap instead of sorting every match. Ranked prefixes are
+        cached per normalized query, so later pages are list slices.
+
+        filters is a dict of FacetIndex.select() arguments (role,
+        year_from, year_to, skills) that every match must pass. With
+        filters and an empty query, all users passing them match.
+        """
+        ranked_ids, total, _ = self._lookup(query, limit, filters or {})
+        return ranked_ids[:limit], total
+
+    def facet_counts(self, query, filters=None):
+        """Return {facet: [(value, count)]} over the users matching query and filters."""
+        _, _, matched = self._lookup(query, 0, filters or {})
+        with self.lock:
+            return self.facets.counts(matched)
+
+    def _lookup(self, query, limit, filters):
+        with self.lock:
+            self._refresh()
+        tokens = tokenize(query)
+        key = (' '.join(sorted(tokens)), repr(sorted(filters.items())))
+        cached = self.results.get(key)
+        if cached is not None:
+            ranked_ids, total, _ = cached
+            if len(ranked_ids) == total or (limit is not None and limit <= len(ranked_ids)):
+                return cached
+            # Cached prefix is too short; fetch at least twice as deep
+            limit = None if limit is None else max(limit, 2 * len(ranked_ids))
+        with self.lock:
+            entry = self._rank(tokens, limit, self.facets.select(**filters))
+            self.results.set(key, entry)
+        return entry
+
+    def _rank(self, tokens, limit, allowed):
+        """Return (ranked IDs, total, bitset of all matches); allowed is a facet bitset or None."""
+        with self.lock:
+            if not self.doc_lengths or (not tokens and allowed is None):
+                return [], 0, 0
+            scores = {}
+            if not tokens:
+                # Facet-only browse: everyone passing the filters, in ID order
+                scores = dict.fromkeys(iter_bits(allowed), 0.0)
+            else:
+                avgdl = self.total_length / len(self.doc_lengths)
+                for token in tokens:
+                    postings = self.postings.get(token)
+                    if postings is not None:
+                        self._accumulate(scores, postings, 1.0, avgdl)
+                        continue
+                    # Probably a typo; match close vocabulary terms instead
+                    for key, dist in self.fuzzy.lookup(token):
+                        self._accumulate(scores, self.postings[key], self.FUZZY_WEIGHT / dist, avgdl)
+                if allowed is not None:
+                    scores = {uid: score for uid, score in scores.items() if allowed >> uid & 1}
+                if not scores:
+                    return [], 0, 0
+                for token in tokens:
+                    for key in self.substrings.lookup(token):
+                        if key != token:
+                            self._accumulate(scores, self.postings[key], self.PARTIAL_WEIGHT, avgdl, only_existing=True)
+        matched = 0
+        for uid in scores:
+            matched |= 1 << uid
+        rank_key = lambda item: (-item[1], item[0])
+        if limit is None:
+            ranked = sorted(scores.items(), key=rank_key)
+        else:
+            ranked = heapq.nsmallest(limit, scores.items(), key=rank_key)
+        return [uid for uid, _ in ranked], len(scores), matched
+
+search_index = SearchIndex()
@@ -0,0 +1,179 @@
+from models import db
+from flask import request
+from collections import defaultdict
+from sqlalchemy import event
+import hashlib
+import re
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)  # statements per request
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAM_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_VALUES_LISTS = re.compile(r'(VALUES\s*\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+', re.IGNORECASE)
+
+def fingerprint(statement):
+    """Reduce a statement to its shape: literals become ?, IN/VALUES lists (...), whitespace collapsed."""
+    shape = ' '.join(statement.split())
+    shape = _LITERALS.sub('?', shape)
+    shape = _PARAM_LISTS.sub('(...)', shape)
+    return _VALUES_LISTS.sub(r'\1', shape)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+class RequestMetrics:
+    """Per-route latency and SQL statement metrics for this process.
+
+    Counts every statement the engine runs, attributing it to the request
+    on the current thread when there is one. Statements slower than
+    `slow_query_threshold` seconds are recorded under their fingerprint,
+    with an app.logger warning at most once per fingerprint every
+    `slow_query_log_interval` seconds. Each worker process keeps its own
+    numbers, so scrape every worker.
+    """
+
+    def __init__(self, slow_query_threshold=0.1, slow_query_log_interval=60):
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_query_log_interval = slow_query_log_interval  # seconds between log lines per fingerprint
+        self.lock = threading.Lock()
+        self.current = threading.local()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # (route, method) -> seconds
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))  # (route, method) -> statements
+        self.db_seconds = defaultdict(float)  # (route, method) -> time in the database
+        self.responses = defaultdict(int)  # (route, method, status) -> requests
+        self.statements = 0
+        self.statement_seconds = 0.0
+        self.slow_queries = {}  # fingerprint hash -> {fingerprint, count, total, max, last_route}
+        self.logged_at = {}  # fingerprint hash -> when it was last logged
+        self.app = None
+
+    def init_app(self, app):
+        """Hook into the app's requests and the engine's cursor events. Call inside an app context."""
+        self.app = app
+        self.slow_query_threshold = app.config.get('SLOW_QUERY_THRESHOLD', self.slow_query_threshold)
+        self.slow_query_log_interval = app.config.get('SLOW_QUERY_LOG_INTERVAL', self.slow_query_log_interval)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.teardown_request(self.clear_request)
+        event.listen(db.engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def start_request(self):
+        self.current.stats = {'start': time.perf_counter(), 'queries': 0, 'db_seconds': 0.0}
+
+    def finish_request(self, response):
+        stats = getattr(self.current, 'stats', None)
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats['start']
+        key = (request.url_rule.rule if request.url_rule else 'unmatched', request.method)
+        with self.lock:
+            self.latency[key].observe(elapsed)
+            self.queries[key].observe(stats['queries'])
+            self.db_seconds[key] += stats['db_seconds']
+            self.responses[key + (response.status_code,)] += 1
+        if self.app.config.get('QUERY_COUNT_HEADER'):
+            response.headers['X-Query-Count'] = str(stats['queries'])
+            response.headers['X-DB-Time-Ms'] = f"{stats['db_seconds'] * 1000:.1f}"
+        return response
+
+    def clear_request(self, exc=None):
+        self.current.stats = None
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        stats = getattr(self.current, 'stats', None)
+        if stats is not None:
+            stats['queries'] += 1
+            stats['db_seconds'] += elapsed
+        with self.lock:
+            self.statements += 1
+            self.statement_seconds += elapsed
+        if elapsed >= self.slow_query_threshold:
+            self.record_slow_query(statement, elapsed)
+
+    def record_slow_query(self, statement, elapsed):
+        shape = fingerprint(statement)
+        digest = hashlib.sha1(shape.encode()).hexdigest()[:12]
+        route = request.url_rule.rule if getattr(self.current, 'stats', None) is not None and request.url_rule else 'background'
+        now = time.monotonic()
+        with self.lock:
+            entry = self.slow_queries.setdefault(digest, {'fingerprint': shape, 'count': 0, 'total': 0.0, 'max': 0.0})
+            entry['count'] += 1
+            entry['total'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            entry['last_route'] = route
+            # One line per fingerprint per interval; /admin/slow_queries has the full picture
+            should_log = now - self.logged_at.get(digest, float('-inf')) >= self.slow_query_log_interval
+            if should_log:
+                self.logged_at[digest] = now
+        if should_log and self.app is not None:
+            self.app.logger.warning('Slow query [%s] %.1f ms on %s (%d so far)', digest, elapsed * 1000, route, entry['count'])
+
+    def slow_query_log(self):
+        """Return the slow query fingerprints, slowest total first."""
+        with self.lock:
+            entries = [{'id': digest, **entry} for digest, entry in self.slow_queries.items()]
+        return sorted(entries, key=lambda entry: entry['total'], reverse=True)
+
+    def _histogram_lines(self, name, histograms):
+        lines = []
+        for (route, method), histogram in sorted(histograms.items()):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{name}_bucket{_labels(route=route, method=method, le=bound)} {count}')
+            lines.append(f'{name}_bucket{_labels(route=route, method=method, le="+Inf")} {histogram.count}')
+            lines.append(f'{name}_sum{_labels(route=route, method=method)} {histogram.sum}')
+            lines.append(f'{name}_count{_labels(route=route, method=method)} {histogram.count}')
+        return lines
+
+    def prometheus(self):
+        """Render everything in the Prometheus text exposition format."""
+        with self.lock:
+            lines = ['# HELP alumnet_request_duration_seconds Request latency by route.',
+                     '# TYPE alumnet_request_duration_seconds histogram']
+            lines += self._histogram_lines('alumnet_request_duration_seconds', self.latency)
+            lines += ['# HELP alumnet_request_queries SQL statements issued per request by route.',
+                      '# TYPE alumnet_request_queries histogram']
+            lines += self._histogram_lines('alumnet_request_queries', self.queries)
+            lines += ['# HELP alumnet_request_db_seconds_total Time spent in SQL statements by route.',
+                      '# TYPE alumnet_request_db_seconds_total counter']
+            lines += [f'alumnet_request_db_seconds_total{_labels(route=route, method=method)} {seconds}'
+                      for (route, method), seconds in sorted(self.db_seconds.items())]
+            lines += ['# HELP alumnet_requests_total Responses by route and status.',
+                      '# TYPE alumnet_requests_total counter']
+            lines += [f'alumnet_requests_total{_labels(route=route, method=method, status=status)} {count}'
+                      for (route, method, status), count in sorted(self.responses.items())]
+            lines += ['# HELP alumnet_db_statements_total SQL statements run, including background jobs.',
+                      '# TYPE alumnet_db_statements_total counter',
+                      f'alumnet_db_statements_total {self.statements}',
+                      '# HELP alumnet_db_seconds_total Time spent in SQL statements, including background jobs.',
+                      '# TYPE alumnet_db_seconds_total counter',
+                      f'alumnet_db_seconds_total {self.statement_seconds}',
+                      '# HELP alumnet_slow_queries_total Statements over the slow query threshold by fingerprint.',
+                      '# TYPE alumnet_slow_queries_total counter']
+            lines += [f'alumnet_slow_queries_total{_labels(fingerprint=digest)} {entry["count"]}'
+                      for digest, entry in sorted(self.slow_queries.items())]
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
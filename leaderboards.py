@@ -0,0 +1,90 @@
+from models import db, User, UserScore, DailyScore, LeaderboardEntry
+from scheduler import PeriodicJob
+from scores import COUNTER_SOURCES, DAILY_SOURCES, SCORE_WEIGHTS, top_scores
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from sqlalchemy import insert
+
+# window -> days it covers, counting today. DailyScore buckets older than
+# the longest window are pruned, so extend this before reading further back.
+WINDOWS = {'week': 7, 'month': 30}
+ALL_BATCHES = 0  # LeaderboardEntry.batch_year for the board across every batch
+
+def window_start(days, today=None):
+    today = today or datetime.utcnow().date()
+    return today - timedelta(days=days - 1)
+
+def window_scores(window, batch_year=None, limit=None):
+    """Sum each user's buckets in the window; return [(user_id, batch_year, score)] best first."""
+    total = db.func.sum(DailyScore.score)
+    query = db.session.query(DailyScore.user_id, User.batch_year, total).join(User, User.id == DailyScore.user_id).filter(
+        DailyScore.day >= window_start(WINDOWS[window])
+    ).group_by(DailyScore.user_id, User.batch_year).having(total > 0).order_by(total.desc(), DailyScore.user_id)
+    if batch_year is not None:
+        query = query.filter(User.batch_year == batch_year)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def refresh_leaderboards(limit=100):
+    """Rebuild every window's precomputed boards, overall and per batch year, in one transaction.
+
+    One grouped query per window feeds all of its boards. Also prunes
+    DailyScore buckets that have fallen out of every window.
+    Returns {window: users ranked}.
+    """
+    counts = {}
+    for window in WINDOWS:
+        boards = defaultdict(list)
+        for user_id, batch_year, score in window_scores(window):
+            for board in (ALL_BATCHES, batch_year):
+                if board is not None and len(boards[board]) < limit:
+                    boards[board].append({'period': window, 'batch_year': board, 'rank': len(boards[board]) + 1,
+                                          'user_id': user_id, 'score': score})
+        LeaderboardEntry.query.filter_by(period=window).delete(synchronize_session=False)
+        rows = [row for board in boards.values() for row in board]
+        if rows:
+            db.session.execute(insert(LeaderboardEntry.__table__), rows)
+        counts[window] = len(boards[ALL_BATCHES])
+    DailyScore.query.filter(DailyScore.day < window_start(max(WINDOWS.values()))).delete(synchronize_session=False)
+    db.session.commit()
+    return counts
+
+def leaderboard_rows(window='all', batch_year=None, limit=100):
+    """Return [(user, score)] best first for a window, optionally one batch year only.
+
+    'all' reads the all-time UserScore ranking; the other windows read the
+    rows last written by refresh_leaderboards.
+    """
+    if window == 'all':
+        if batch_year is None:
+            return [(user_score.user, user_score.score) for user_score in top_scores(limit)]
+        rows = UserScore.query.join(User, User.id == UserScore.user_id).options(db.contains_eager(UserScore.user)).filter(
+            User.batch_year == batch_year
+        ).order_by(UserScore.score.desc(), UserScore.user_id).limit(limit)
+        return [(user_score.user, user_score.score) for user_score in rows]
+    entries = LeaderboardEntry.query.options(db.joinedload(LeaderboardEntry.user)).filter_by(
+        period=window, batch_year=ALL_BATCHES if batch_year is None else batch_year
+    ).order_by(LeaderboardEntry.rank).limit(limit)
+    return [(entry.user, entry.score) for entry in entries]
+
+def backfill_daily_scores():
+    """Fill DailyScore for the longest window with one grouped count per source table."""
+    since = window_start(max(WINDOWS.values()))
+    buckets = defaultdict(dict)
+    for counter, timestamp in DAILY_SOURCES.items():
+        owner = COUNTER_SOURCES[counter][1]
+        day = db.func.date(timestamp)
+        for user_id, bucket_day, count in db.session.query(owner, day, db.func.count()).filter(
+                timestamp >= datetime.combine(since, datetime.min.time())).group_by(owner, day):
+            buckets[(user_id, bucket_day)][counter] = count
+    rows = []
+    for (user_id, bucket_day), bucket_counts in buckets.items():
+        row = {counter: bucket_counts.get(counter, 0) for counter in DAILY_SOURCES}
+        row.update(user_id=user_id, day=date.fromisoformat(bucket_day),
+                   score=sum(SCORE_WEIGHTS[counter] * count for counter, count in bucket_counts.items()))
+        rows.append(row)
+    if rows:
+        db.session.execute(insert(DailyScore.__table__), rows)
+
+leaderboard_job = PeriodicJob('leaderboards', lambda app: refresh_leaderboards(app.config['LEADERBOARD_SIZE']))
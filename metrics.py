@@ -0,0 +1,133 @@
+from models import db, User, Post, Message, Job, Event, Badge, Mentorship, JobApplication, MetricTotal, MetricBucket
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert, inspect, update
+
+# model -> total its rows count towards
+MODEL_COUNTERS = {
+    User: 'users',
+    Post: 'posts',
+    Message: 'messages',
+    Job: 'jobs',
+    Event: 'events',
+    Badge: 'badges',
+    Mentorship: 'mentorships',
+    JobApplication: 'applications',
+}
+ACCEPTED_MENTORSHIPS = 'mentorships_accepted'
+
+# counter -> (timestamp column, row filter) for counters that also get a
+# time series. Mentorships have no accepted_at, so backfilled acceptances
+# are bucketed by when they were requested.
+SERIES = {
+    'users': (User.created_at, None),
+    'posts': (Post.timestamp, None),
+    'messages': (Message.timestamp, None),
+    'applications': (JobApplication.applied_at, None),
+    ACCEPTED_MENTORSHIPS: (Mentorship.created_at, Mentorship.status == 'accepted'),
+}
+
+# resolution -> how long its buckets are kept
+RESOLUTIONS = {'hour': timedelta(days=14), 'day': timedelta(days=730)}
+
+def bucket_start(moment, resolution):
+    if resolution == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _add(connection, table, key, delta):
+    result = connection.execute(
+        update(table).where(*[table.c[name] == value for name, value in key.items()]).values(value=table.c.value + delta))
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(value=delta, **key))
+
+def record(connection, counter, delta=1):
+    """Add delta to a counter's total, and new events to its current hour and day buckets.
+
+    Runs on the flushing connection, so it commits or rolls back with the
+    rows being counted. Removals only lower the total; a time series
+    counts events as they happened.
+    """
+    _add(connection, MetricTotal.__table__, {'name': counter}, delta)
+    if counter in SERIES and delta > 0:
+        now = datetime.utcnow()
+        for resolution in RESOLUTIONS:
+            _add(connection, MetricBucket.__table__,
+                 {'name': counter, 'resolution': resolution, 'bucket_start': bucket_start(now, resolution)}, delta)
+
+def _register_listeners():
+    for model, counter in MODEL_COUNTERS.items():
+        def after_insert(mapper, connection, target, counter=counter):
+            record(connection, counter)
+
+        def after_delete(mapper, connection, target, counter=counter):
+            record(connection, counter, -1)
+
+        event.listen(model, 'after_insert', after_insert)
+        event.listen(model, 'after_delete', after_delete)
+
+    @event.listens_for(Mentorship, 'after_insert')
+    def _accepted_insert(mapper, connection, target):
+        if target.status == 'accepted':
+            record(connection, ACCEPTED_MENTORSHIPS)
+
+    @event.listens_for(Mentorship, 'after_update')
+    def _accepted_update(mapper, connection, target):
+        history = inspect(target).attrs.status.history
+        was_accepted = 'accepted' in history.deleted
+        if history.has_changes() and was_accepted != (target.status == 'accepted'):
+            record(connection, ACCEPTED_MENTORSHIPS, -1 if was_accepted else 1)
+
+    @event.listens_for(Mentorship, 'after_delete')
+    def _accepted_delete(mapper, connection, target):
+        if target.status == 'accepted':
+            record(connection, ACCEPTED_MENTORSHIPS, -1)
+
+_register_listeners()
+
+def totals():
+    """Return {counter: total} with a single read of metric_total."""
+    counts = {counter: 0 for counter in [*MODEL_COUNTERS.values(), ACCEPTED_MENTORSHIPS]}
+    counts.update({total.name: total.value for total in MetricTotal.query})
+    return counts
+
+def series(counter, resolution='day', points=30, now=None):
+    """Return [(bucket start, count)] for the last `points` buckets, oldest first, with empty buckets as 0."""
+    step = timedelta(hours=1) if resolution == 'hour' else timedelta(days=1)
+    last = bucket_start(now or datetime.utcnow(), resolution)
+    first = last - step * (points - 1)
+    values = {bucket.bucket_start: bucket.value for bucket in MetricBucket.query.filter(
+        MetricBucket.name == counter, MetricBucket.resolution == resolution, MetricBucket.bucket_start >= first)}
+    return [(first + step * i, values.get(first + step * i, 0)) for i in range(points)]
+
+def prune_metric_buckets(now=None):
+    """Delete buckets older than their resolution's retention; return how many."""
+    now = now or datetime.utcnow()
+    removed = 0
+    for resolution, keep in RESOLUTIONS.items():
+        removed += MetricBucket.query.filter(
+            MetricBucket.resolution == resolution, MetricBucket.bucket_start < bucket_start(now - keep, resolution)
+        ).delete(synchronize_session=False)
+    return removed
+
+def backfill_metric_totals():
+    """Fill metric_total with one count per table."""
+    rows = [{'name': counter, 'value': model.query.count()} for model, counter in MODEL_COUNTERS.items()]
+    rows.append({'name': ACCEPTED_MENTORSHIPS, 'value': Mentorship.query.filter_by(status='accepted').count()})
+    db.session.execute(insert(MetricTotal.__table__), rows)
+
+def backfill_metric_buckets():
+    """Fill metric_bucket from history with one grouped count per series and resolution."""
+    formats = {'hour': '%Y-%m-%d %H:00:00', 'day': '%Y-%m-%d 00:00:00'}
+    now = datetime.utcnow()
+    rows = []
+    for counter, (timestamp, condition) in SERIES.items():
+        for resolution, keep in RESOLUTIONS.items():
+            bucket = db.func.strftime(formats[resolution], timestamp)
+            query = db.session.query(bucket, db.func.count()).filter(timestamp >= bucket_start(now - keep, resolution))
+            if condition is not None:
+                query = query.filter(condition)
+            for start, count in query.group_by(bucket):
+                rows.append({'name': counter, 'resolution': resolution,
+                             'bucket_start': datetime.fromisoformat(start), 'value': count})
+    if rows:
+        db.session.execute(insert(MetricBucket.__table__), rows)
@@ -0,0 +1,124 @@
+from models import db, User, Post, Like, Comment, Message, Conversation, UserScore, DailyScore, MetricTotal, MetricBucket
+from scores import backfill_user_scores, backfill_badge_bits
+from leaderboards import backfill_daily_scores
+from metrics import backfill_metric_totals, backfill_metric_buckets
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+
+def backfill_post_like_count():
+    db.session.execute(db.update(Post).values(
+        like_count=db.select(db.func.count(Like.id)).where(Like.post_id == Post.id).scalar_subquery()
+    ))
+
+def backfill_post_comment_count():
+    db.session.execute(db.update(Post).values(
+        comment_count=db.select(db.func.count(Comment.id)).where(Comment.post_id == Post.id).scalar_subquery()
+    ))
+
+def backfill_user_updated_at():
+    db.session.execute(db.update(User).values(updated_at=db.func.coalesce(User.created_at, db.func.current_timestamp())))
+
+def mark_existing_messages_read():
+    # Messages sent before read tracking existed were read in the old chat UI
+    db.session.execute(db.update(Message).values(is_read=True))
+
+def backfill_conversations():
+    rows = db.session.query(Message.id, Message.sender_id, Message.receiver_id, Message.timestamp, Message.is_read).order_by(Message.id).all()
+    conversations = {}
+    for message_id, sender_id, receiver_id, timestamp, is_read in rows:
+        pair = (min(sender_id, receiver_id), max(sender_id, receiver_id))
+        conversation = conversations.get(pair)
+        if conversation is None:
+            conversation = conversations[pair] = Conversation(user_a_id=pair[0], user_b_id=pair[1], unread_a=0, unread_b=0)
+        if conversation.last_message_at is None or (timestamp or conversation.last_message_at) >= conversation.last_message_at:
+            conversation.last_message_id = message_id
+            conversation.last_message_at = timestamp
+        if not is_read:
+            if receiver_id == pair[0]:
+                conversation.unread_a += 1
+            else:
+                conversation.unread_b += 1
+    db.session.add_all(conversations.values())
+
+# (table, column) -> function that fills in a column just added to an existing table
+BACKFILLS = {
+    ('post', 'like_count'): backfill_post_like_count,
+    ('post', 'comment_count'): backfill_post_comment_count,
+    ('user_score', 'badge_bits'): backfill_badge_bits,
+}
+
+# (table, column) -> function that sets the starting value of a column just
+# added; unlike BACKFILLS these are not recounts, so they only run once
+INITIAL_VALUES = {
+    ('message', 'is_read'): mark_existing_messages_read,
+    ('user', 'updated_at'): backfill_user_updated_at,
+}
+
+# table -> function that fills in a summary table just created next to existing data
+TABLE_BACKFILLS = {
+    'conversation': backfill_conversations,
+    'user_score': backfill_user_scores,
+    'daily_score': backfill_daily_scores,
+    'metric_total': backfill_metric_totals,
+    'metric_bucket': backfill_metric_buckets,
+}
+
+def add_missing_columns():
+    """Add columns declared on the models to tables that predate them, then backfill them."""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+            db.session.execute(db.text(f'ALTER TABLE {db.engine.dialect.identifier_preparer.quote(table.name)} ADD COLUMN {ddl}'))
+            added.append((table.name, column.name))
+    for key in added:
+        if key in INITIAL_VALUES:
+            INITIAL_VALUES[key]()
+        if key in BACKFILLS:
+            BACKFILLS[key]()
+    db.session.commit()
+    return added
+
+def create_missing_indexes():
+    """Create indexes declared on the models for tables that already existed."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def run_migrations():
+    """Create or bring the database up to date with the models. Safe to run repeatedly."""
+    existing_tables = set(inspect(db.engine).get_table_names())
+    db.create_all()
+    add_missing_columns()
+    if existing_tables:
+        for table, backfill in TABLE_BACKFILLS.items():
+            if table not in existing_tables:
+                backfill()
+        db.session.commit()
+    create_missing_indexes()
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        # Recount denormalized counters, e.g. after editing rows by hand
+        Conversation.query.delete()
+        backfill_conversations()
+        UserScore.query.delete()
+        backfill_user_scores()
+        DailyScore.query.delete()
+        backfill_daily_scores()
+        MetricTotal.query.delete()
+        backfill_metric_totals()
+        MetricBucket.query.delete()
+        backfill_metric_buckets()
+        for backfill in BACKFILLS.values():
+            backfill()
+        db.session.commit()
+        print("Counters backfilled!")
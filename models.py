@@ -14,10 +14,61 @@ class User(db.Model):
     batch_year = db.Column(db.Integer, nullable=True)
     skills = db.Column(db.Text, nullable=True)  # comma-separated
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # search index watermark
 
     def __repr__(self):
         return f'<User {self.username}>'
 
+class UserScore(db.Model):
+    """Per-user activity counters and leaderboard score, kept up to date by the write paths."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    posts_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    messages_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    jobs_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    events_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    badges_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    score = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    badge_bits = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # rule badges earned, see scores.BADGE_RULES
+
+    user = db.relationship('User', backref=db.backref('user_score', uselist=False))
+
+    # Leaderboard order: highest score first, ties by user ID
+    __table_args__ = (db.Index('ix_user_score_rank', score.desc(), user_id),)
+
+class DailyScore(db.Model):
+    """One user's activity counters for one UTC day; windowed leaderboards sum these buckets."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    posts_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    messages_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    jobs_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    events_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    score = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (db.Index('ix_daily_score_day', day),)
+
+class LeaderboardEntry(db.Model):
+    """One row of a precomputed windowed leaderboard, rebuilt by leaderboards.refresh_leaderboards."""
+    period = db.Column(db.String(10), primary_key=True)  # week, month
+    batch_year = db.Column(db.Integer, primary_key=True)  # 0 for everyone
+    rank = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+
+    user = db.relationship('User')
+
+class MetricTotal(db.Model):
+    """Running total behind one /metrics counter, kept up to date by metrics.py."""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+class MetricBucket(db.Model):
+    """How many times a metric's event happened in one hour or day, for the /metrics charts."""
+    name = db.Column(db.String(50), primary_key=True)
+    resolution = db.Column(db.String(10), primary_key=True)  # hour, day
+    bucket_start = db.Column(db.DateTime, primary_key=True)  # UTC
+    value = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -26,9 +77,13 @@ class Post(db.Model):
     media_type = db.Column(db.String(10), nullable=True)  # image, video
     media_path = db.Column(db.String(200), nullable=True)  # path to uploaded file
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # maintained by like_post
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # maintained by add_comment
 
     user = db.relationship('User', backref=db.backref('posts', lazy=True))
 
+    __table_args__ = (db.Index('ix_post_audience_timestamp', 'audience', 'timestamp'),)
+
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -37,10 +92,33 @@ class Message(db.Model):
     media_type = db.Column(db.String(10), nullable=True)  # image, video
     media_path = db.Column(db.String(200), nullable=True)  # path to uploaded file
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    is_read = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
 
     sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_messages')
     receiver = db.relationship('User', foreign_keys=[receiver_id], backref='received_messages')
 
+    __table_args__ = (db.Index('ix_message_pair_timestamp', 'sender_id', 'receiver_id', 'timestamp'),)
+
+class Conversation(db.Model):
+    """Summary of the messages between two users, keyed by the ordered pair user_a_id <= user_b_id."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_a_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_b_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    unread_a = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # unread messages sent to user_a
+    unread_b = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # unread messages sent to user_b
+
+    user_a = db.relationship('User', foreign_keys=[user_a_id])
+    user_b = db.relationship('User', foreign_keys=[user_b_id])
+    last_message = db.relationship('Message')
+
+    __table_args__ = (
+        db.UniqueConstraint('user_a_id', 'user_b_id', name='uq_conversation_pair'),
+        db.Index('ix_conversation_user_a_last', 'user_a_id', 'last_message_at'),
+        db.Index('ix_conversation_user_b_last', 'user_b_id', 'last_message_at'),
+    )
+
 class Mentorship(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     mentor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -145,6 +223,11 @@ class Activity(db.Model):
 
     user = db.relationship('User', backref=db.backref('activities', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_activity_user_created', 'user_id', 'created_at'),
+        db.Index('ix_activity_created', 'created_at'),
+    )
+
 class Connection(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -164,5 +247,23 @@ class Notification(db.Model):
     related_id = db.Column(db.Integer, nullable=True)  # ID of related object (message, job, event, etc.)
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    group_key = db.Column(db.String(100), nullable=True)  # source that repeats coalesce on, e.g. user:5
+    occurrences = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    user = db.relationship('User', backref=db.backref('notifications', lazy=True))
 
-    user = db.relationship('User', backref=db.backref('notifications', lazy=True))
\ No newline at end of file
+    __table_args__ = (
+        db.Index('ix_notification_user_created', 'user_id', 'created_at'),
+        db.Index('ix_notification_user_group', 'user_id', 'group_key'),
+        db.Index('ix_notification_created', 'created_at'),
+    )
+
+class FanOutJob(db.Model):
+    """Progress of one background fan-out, so whichever worker serves /fanout_status can report it."""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    state = db.Column(db.String(10), nullable=False, default='queued')  # queued, running, done, failed
+    done = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
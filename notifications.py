@@ -0,0 +1,168 @@
+from models import db, Notification
+from cache import TTLCache, StampFile
+from side_effects import on_commit
+from timeline import encode_cursor, decode_cursor
+from datetime import datetime
+from sqlalchemy import bindparam, insert, select, update
+import threading
+
+class UnreadCounts:
+    """Per-user unread notification counts cached in this process.
+
+    Every change replaces a stamp file (see cache.StampFile), and a
+    process whose stamp is out of date drops all of its cached counts
+    before answering, so the navbar badge is right on the next request
+    in every worker. Call open() at startup.
+    """
+
+    def __init__(self, maxsize=4096, ttl=300):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.stamp_file = StampFile()
+        self.stamp = None
+        self.lock = threading.Lock()
+
+    def open(self, stamp_path):
+        self.stamp_file.open(stamp_path)
+        with self.lock:
+            self.cache.clear()
+            self.stamp = self.stamp_file.stamp()
+
+    def _ensure_fresh(self):
+        stamp = self.stamp_file.stamp()
+        if stamp != self.stamp:
+            self.cache.clear()
+            self.stamp = stamp
+
+    def get(self, user_id):
+        with self.lock:
+            self._ensure_fresh()
+            return self.cache.get(user_id)
+
+    def set(self, user_id, count):
+        # A change committed since get() moves the stamp, so a stale count is dropped on the next get()
+        self.cache.set(user_id, count)
+
+    def invalidate(self, user_ids):
+        with self.lock:
+            self._ensure_fresh()
+            for user_id in user_ids:
+                self.cache.pop(user_id)
+            self.stamp = self.stamp_file.touch()
+
+unread_counts = UnreadCounts()
+
+def unread_count(user_id):
+    """Return how many unread notifications a user has, cached between changes."""
+    count = unread_counts.get(user_id)
+    if count is None:
+        count = Notification.query.filter_by(user_id=user_id, is_read=False).count()
+        unread_counts.set(user_id, count)
+    return count
+
+def invalidate_unread(user_ids):
+    """Forget cached counts in every process, e.g. after notifications were inserted in bulk."""
+    unread_counts.invalidate(user_ids)
+
+def add_notification(user_id, notification_type, title, message, related_id=None, group_key=None, summary=None):
+    """Add a notification, or fold it into an unread one of the same type and group. The caller commits.
+
+    group_key names the source (e.g. 'user:5' for messages from user 5).
+    When an unread notification with the same type and group exists, its
+    occurrences go up by one, its text becomes summary.format(count=...)
+    and it moves to the top. Without a group_key or summary every
+    notification gets its own row.
+    """
+    notification = None
+    if group_key is not None and summary is not None:
+        notification = Notification.query.filter_by(
+            user_id=user_id, type=notification_type, group_key=group_key, is_read=False
+        ).order_by(Notification.id.desc()).first()
+    if notification is None:
+        db.session.add(Notification(user_id=user_id, type=notification_type, title=title, message=message,
+                                    related_id=related_id, group_key=group_key))
+        on_commit(lambda: invalidate_unread([user_id]))
+        return
+    notification.occurrences = Notification.occurrences + 1
+    db.session.flush()
+    notification.message = summary.format(count=notification.occurrences)
+    notification.related_id = related_id
+    notification.created_at = datetime.utcnow()
+
+def add_notifications(connection, user_ids, notification_type, title, message, related_ids=None, related_id=None,
+                      group_key=None, summary=None):
+    """Bulk add_notification for many recipients on the flushing connection. The caller commits.
+
+    related_ids maps a recipient to its own related_id, falling back to
+    related_id. Recipients with an unread notification of the same type
+    and group get it updated in place, the rest get new rows.
+    """
+    related_ids = related_ids or {}
+    notification = Notification.__table__
+    now = datetime.utcnow()
+    existing = {}
+    if group_key is not None and summary is not None:
+        existing = dict(connection.execute(
+            select(notification.c.user_id, db.func.max(notification.c.id)).where(
+                notification.c.user_id.in_(user_ids), notification.c.type == notification_type,
+                notification.c.group_key == group_key, notification.c.is_read == False
+            ).group_by(notification.c.user_id)
+        ).all())
+    if existing:
+        coalesced = connection.execute(
+            update(notification).where(notification.c.id.in_(existing.values())).values(
+                occurrences=notification.c.occurrences + 1, created_at=now
+            ).returning(notification.c.id, notification.c.user_id, notification.c.occurrences)
+        ).all()
+        connection.execute(
+            update(notification).where(notification.c.id == bindparam('notification_id')).values(
+                message=bindparam('new_message'), related_id=bindparam('new_related_id')),
+            [{'notification_id': notification_id, 'new_message': summary.format(count=occurrences),
+              'new_related_id': related_ids.get(user_id, related_id)}
+             for notification_id, user_id, occurrences in coalesced])
+    inserts = [{
+        'user_id': user_id,
+        'type': notification_type,
+        'title': title,
+        'message': message,
+        'related_id': related_ids.get(user_id, related_id),
+        'group_key': group_key,
+        'is_read': False,
+        'created_at': now,
+    } for user_id in user_ids if user_id not in existing]
+    if inserts:
+        connection.execute(insert(notification), inserts)
+
+def mark_read(notification):
+    """Mark one notification read. The caller commits."""
+    if not notification.is_read:
+        notification.is_read = True
+        on_commit(lambda: invalidate_unread([notification.user_id]))
+
+def mark_all_read(user_id):
+    """Mark all of a user's notifications read. The caller commits."""
+    Notification.query.filter_by(user_id=user_id, is_read=False).update({Notification.is_read: True}, synchronize_session=False)
+    on_commit(lambda: invalidate_unread([user_id]))
+
+def remove_notification(notification):
+    """Delete a notification. The caller commits."""
+    user_id, was_unread = notification.user_id, not notification.is_read
+    db.session.delete(notification)
+    if was_unread:
+        on_commit(lambda: invalidate_unread([user_id]))
+
+def notifications_page(user_id, cursor=None, limit=20):
+    """Return (notifications newest first, cursor for the next page or None).
+
+    Keyed on (created_at, id) over ix_notification_user_created.
+    """
+    before = decode_cursor(cursor) if cursor else None
+    query = Notification.query.filter_by(user_id=user_id)
+    if before is not None:
+        query = query.filter((Notification.created_at < before[0]) |
+                             ((Notification.created_at == before[0]) & (Notification.id < before[1])))
+    notifications = query.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(notifications) > limit:
+        notifications = notifications[:limit]
+        next_cursor = encode_cursor(notifications[-1].created_at, notifications[-1].id)
+    return notifications, next_cursor
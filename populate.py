@@ -3,6 +3,7 @@ import time
 import sqlite3
 from app import app, db
 from models import User, Post, Message, Job, Event
+from index import search_index
 from werkzeug.security import generate_password_hash
 
 def populate_database():
@@ -59,6 +60,8 @@ def populate_database():
                         db.session.add(user)
                         if not retry_commit():
                             print(f"Failed to commit user {alumni_id} after retries")
+                        else:
+                            search_index.add_user(user)
                     except KeyboardInterrupt:
                         print("Password hashing interrupted. Skipping user creation.")
                         continue
@@ -102,6 +105,8 @@ def populate_database():
                     db.session.add(user)
                     if not retry_commit():
                         print(f"Failed to commit faculty user {faculty_id} after retries")
+                    else:
+                        search_index.add_user(user)
                 else:
                     # Update existing user's password to faculty_id
                     try:
@@ -0,0 +1,183 @@
+from sqlalchemy import text
+import json
+import queue
+import threading
+import time
+
+class Subscription:
+    """A subscriber's queue of JSON payloads published to one channel."""
+
+    def __init__(self, hub, channel, maxsize=100):
+        self.hub = hub
+        self.channel = channel
+        self.queue = queue.Queue(maxsize)
+
+    def put(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            # A stalled client; it catches up from Last-Event-ID when it reconnects
+            pass
+
+    def get(self, timeout=None):
+        """Return the next payload, or None if nothing arrived within timeout."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+class PubSubHub:
+    """Fans published events out to the subscribers in this process.
+
+    With no backend, publish() delivers straight to local subscribers,
+    which is all a single process needs. With several workers a backend
+    carries each event to every process, and its listener thread hands it
+    back to deliver() there. See configure() for the available backends.
+    """
+
+    def __init__(self):
+        self.channels = {}
+        self.lock = threading.Lock()
+        self.backend = None
+
+    def configure(self, url='memory://', engine=None):
+        """Pick the transport from a URL: memory://, database:// or redis://host/db.
+
+        database:// is a stand-in for a real broker that works wherever the
+        workers share the app database (e.g. several workers on one host).
+        """
+        if self.backend is not None:
+            self.backend.stop()
+            self.backend = None
+        if url.startswith('database://'):
+            self.backend = DatabaseBackend(self, engine)
+        elif url.startswith('redis://'):
+            self.backend = RedisBackend(self, url)
+        elif not url.startswith('memory://'):
+            raise ValueError(f'Unknown pub/sub backend: {url}')
+        if self.backend is not None:
+            self.backend.start()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.channels[subscription.channel]
+
+    def publish(self, channel, data):
+        """Publish a JSON-serializable event to everyone subscribed to channel."""
+        payload = json.dumps(data)
+        if self.backend is None:
+            self.deliver(channel, payload)
+        else:
+            self.backend.publish(channel, payload)
+
+    def deliver(self, channel, payload):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(payload)
+
+class DatabaseBackend:
+    """Carries events between workers through a table in the app database.
+
+    Each process polls for rows newer than the last one it saw; rows are
+    pruned once they are older than retention seconds.
+    """
+
+    TABLE = 'pubsub_event'
+
+    def __init__(self, hub, engine, poll_interval=0.5, retention=60):
+        self.hub = hub
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.last_id = 0
+        self.stopped = threading.Event()
+
+    def start(self):
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                f'CREATE TABLE IF NOT EXISTS {self.TABLE} ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, channel VARCHAR(100) NOT NULL, '
+                'payload TEXT NOT NULL, created_at FLOAT NOT NULL)'
+            ))
+            self.last_id = connection.execute(text(f'SELECT max(id) FROM {self.TABLE}')).scalar() or 0
+        threading.Thread(target=self.listen, name='pubsub-database', daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def publish(self, channel, payload):
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(f'INSERT INTO {self.TABLE} (channel, payload, created_at) VALUES (:channel, :payload, :created_at)'),
+                {'channel': channel, 'payload': payload, 'created_at': time.time()},
+            )
+
+    def listen(self):
+        pruned_at = time.monotonic()
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                with self.engine.connect() as connection:
+                    rows = connection.execute(
+                        text(f'SELECT id, channel, payload FROM {self.TABLE} WHERE id > :last_id ORDER BY id'),
+                        {'last_id': self.last_id},
+                    ).all()
+                for event_id, channel, payload in rows:
+                    self.last_id = event_id
+                    self.hub.deliver(channel, payload)
+                if time.monotonic() - pruned_at > self.retention:
+                    pruned_at = time.monotonic()
+                    with self.engine.begin() as connection:
+                        connection.execute(text(f'DELETE FROM {self.TABLE} WHERE created_at < :cutoff'),
+                                           {'cutoff': time.time() - self.retention})
+            except Exception as e:
+                print(f'Pub/sub poll failed: {e}')
+
+class RedisBackend:
+    """Carries events between workers over Redis pub/sub (needs the redis package)."""
+
+    PREFIX = 'alumnet:'
+
+    def __init__(self, hub, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis package is required for a redis:// pub/sub backend')
+        self.hub = hub
+        self.client = redis.Redis.from_url(url)
+        self.pubsub = None
+
+    def start(self):
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.psubscribe(f'{self.PREFIX}*')
+        threading.Thread(target=self.listen, name='pubsub-redis', daemon=True).start()
+
+    def stop(self):
+        if self.pubsub is not None:
+            self.pubsub.close()
+
+    def publish(self, channel, payload):
+        self.client.publish(self.PREFIX + channel, payload)
+
+    def listen(self):
+        try:
+            for message in self.pubsub.listen():
+                channel = message['channel'].decode()[len(self.PREFIX):]
+                self.hub.deliver(channel, message['data'].decode())
+        except Exception as e:
+            print(f'Pub/sub listener stopped: {e}')
+
+chat_hub = PubSubHub()
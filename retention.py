@@ -0,0 +1,152 @@
+from models import db, Activity, Notification
+from notifications import invalidate_unread
+from metrics import prune_metric_buckets
+from scheduler import PeriodicJob
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import select, text
+import gzip
+import json
+import os
+import time
+
+# Days to keep rows, per activity_type / notification type. 'default' covers
+# every other type. Notification TTLs apply to read rows; unread ones are
+# kept for 'unread' days.
+DEFAULT_TTLS = {
+    'activity': {'default': 180, 'message_sent': 30, 'comment_added': 90, 'connection_sent': 90},
+    'notification': {'default': 90, 'message': 30, 'unread': 365},
+}
+
+def _expired(model, type_column, ttls, now, extra=None):
+    """Yield (rule name, condition) for rows past their TTL."""
+    listed = [name for name in ttls if name not in ('default', 'unread')]
+    for name in listed:
+        condition = (type_column == name) & (model.created_at < now - timedelta(days=ttls[name]))
+        yield name, condition if extra is None else condition & extra
+    if 'default' in ttls:
+        condition = type_column.notin_(listed) & (model.created_at < now - timedelta(days=ttls['default']))
+        yield 'default', condition if extra is None else condition & extra
+
+def expired_rules(ttls=None, now=None):
+    """Return [(table name, rule name, condition)] for everything due for archiving."""
+    ttls = ttls or DEFAULT_TTLS
+    now = now or datetime.utcnow()
+    rules = []
+    for name, condition in _expired(Activity, Activity.activity_type, ttls.get('activity', {}), now):
+        rules.append(('activity', name, condition))
+    notification_ttls = ttls.get('notification', {})
+    for name, condition in _expired(Notification, Notification.type, notification_ttls, now, Notification.is_read == True):
+        rules.append(('notification', name, condition))
+    if 'unread' in notification_ttls:
+        rules.append(('notification', 'unread', (Notification.is_read != True) &
+                      (Notification.created_at < now - timedelta(days=notification_ttls['unread']))))
+    return rules
+
+def _archive(archive_dir, table_name, rows):
+    """Append rows as gzipped JSON lines to one file per table and month."""
+    by_month = defaultdict(list)
+    for row in rows:
+        created_at = row['created_at']
+        by_month[created_at.strftime('%Y-%m') if created_at else 'undated'].append(row)
+    os.makedirs(archive_dir, exist_ok=True)
+    for month, month_rows in by_month.items():
+        path = os.path.join(archive_dir, f'{table_name}-{month}.jsonl.gz')
+        # Appending makes a multi-member gzip file, which gzip.open reads back as one stream
+        with gzip.open(path, 'at', encoding='utf-8') as archive:
+            for row in month_rows:
+                archive.write(json.dumps(dict(row), default=lambda value: value.isoformat()) + '\n')
+
+def prune(table_name, condition, archive_dir=None, batch_size=500, pause=0.05, dry_run=False):
+    """Archive and delete the rows matching condition in batches; return how many.
+
+    Each batch is its own short transaction, with a pause between batches
+    so request handlers can take the SQLite write lock in between.
+    """
+    table = db.metadata.tables[table_name]
+    if dry_run:
+        return db.session.execute(select(db.func.count()).select_from(table).where(condition)).scalar()
+    total = 0
+    while True:
+        rows = db.session.execute(select(table).where(condition).order_by(table.c.id).limit(batch_size)).mappings().all()
+        if not rows:
+            return total
+        if archive_dir:
+            _archive(archive_dir, table_name, rows)
+        db.session.execute(table.delete().where(table.c.id.in_([row['id'] for row in rows])))
+        db.session.commit()
+        if table_name == 'notification':
+            invalidate_unread({row['user_id'] for row in rows})
+        total += len(rows)
+        if len(rows) < batch_size:
+            return total
+        time.sleep(pause)
+
+def incremental_vacuum(pages=1000):
+    """Return up to `pages` free pages to the OS, if incremental auto-vacuum is on."""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    if db.session.execute(text('PRAGMA auto_vacuum')).scalar() != 2:
+        print('Incremental vacuum is off; run "python retention.py --enable-incremental-vacuum" once to turn it on.')
+        return False
+    db.session.commit()
+    # sqlite3's execute() steps this pragma once, freeing a single page;
+    # executescript() runs it to completion
+    connection = db.engine.raw_connection()
+    try:
+        connection.driver_connection.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+    finally:
+        connection.close()
+    return True
+
+def enable_incremental_vacuum():
+    """Switch the database to incremental auto-vacuum. Rewrites the whole file, so run it offline."""
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+        connection.execute(text('VACUUM'))
+
+def run_retention(config, dry_run=False):
+    """Apply the configured TTLs, drop expired metric buckets, then compact.
+
+    Returns ({(table, rule): rows archived}, metric buckets dropped).
+    Buckets are deleted outright, not archived, and not touched on a dry run.
+    """
+    counts = {}
+    for table_name, rule, condition in expired_rules(config.get('RETENTION_TTLS')):
+        counts[(table_name, rule)] = prune(
+            table_name, condition,
+            archive_dir=config.get('RETENTION_ARCHIVE_DIR'),
+            batch_size=config.get('RETENTION_BATCH_SIZE', 500),
+            dry_run=dry_run,
+        )
+    dropped = 0
+    if not dry_run:
+        dropped = prune_metric_buckets()
+        db.session.commit()
+        if dropped or any(counts.values()):
+            incremental_vacuum(config.get('RETENTION_VACUUM_PAGES', 1000))
+    return counts, dropped
+
+def _scheduled_retention(app):
+    counts, dropped = run_retention(app.config)
+    if any(counts.values()):
+        print(f'Retention archived {sum(counts.values())} rows')
+    if dropped:
+        print(f'Retention dropped {dropped} expired metric buckets')
+    return counts, dropped
+
+retention_job = PeriodicJob('retention', _scheduled_retention)
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+    with app.app_context():
+        if '--enable-incremental-vacuum' in sys.argv:
+            enable_incremental_vacuum()
+            print("Incremental vacuum enabled!")
+        dry_run = '--dry-run' in sys.argv
+        counts, dropped = run_retention(app.config, dry_run=dry_run)
+        for (table_name, rule), count in counts.items():
+            print(f"{table_name} [{rule}]: {count} rows {'due' if dry_run else 'archived'}")
+        if not dry_run:
+            print(f"metric_bucket: {dropped} expired buckets dropped")
@@ -0,0 +1,54 @@
+from models import db
+import os
+import threading
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+class PeriodicJob:
+    """Runs fn(app) in an app context every `interval` seconds on a background thread.
+
+    With several workers, a lock file in the instance folder makes sure
+    only one of them runs the job at a time; the others skip that round.
+    trigger() runs the job early.
+    """
+
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+        self.app = None
+        self.interval = None
+        self.wakeup = threading.Event()
+
+    def start(self, app, interval):
+        if self.app is not None or not interval:
+            return
+        self.app = app
+        self.interval = interval
+        threading.Thread(target=self.work, name=self.name, daemon=True).start()
+
+    def trigger(self):
+        self.wakeup.set()
+
+    def run_once(self):
+        """Run the job now unless another process is running it; returns fn's result."""
+        lock_path = os.path.join(self.app.instance_path, f'{self.name}.lock')
+        with open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None
+            with self.app.app_context():
+                try:
+                    return self.fn(self.app)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f'{self.name} job failed: {e}')
+
+    def work(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.run_once()
@@ -0,0 +1,190 @@
+from models import db, User, Post, Message, Job, Event, Badge, UserScore, DailyScore
+from scheduler import PeriodicJob
+from side_effects import on_commit
+from stats import invalidate_user_stats
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from sqlalchemy import event, insert, update
+
+SCORE_WEIGHTS = {'posts_count': 10, 'messages_count': 5, 'jobs_count': 20, 'events_count': 15, 'badges_count': 25}
+POSITION_BADGES = ['1st Place', '2nd Place', '3rd Place']
+
+# counter -> (model, column holding the user it counts for)
+COUNTER_SOURCES = {
+    'posts_count': (Post, Post.user_id),
+    'messages_count': (Message, Message.sender_id),
+    'jobs_count': (Job, Job.user_id),
+    'events_count': (Event, Event.user_id),
+    'badges_count': (Badge, Badge.user_id),
+}
+
+# counter -> timestamp column of its source table; these are also kept per
+# day in DailyScore. Badges are left out so windowed scores reflect activity.
+DAILY_SOURCES = {
+    'posts_count': Post.timestamp,
+    'messages_count': Message.timestamp,
+    'jobs_count': Job.created_at,
+    'events_count': Event.created_at,
+}
+
+BadgeRule = namedtuple('BadgeRule', 'badge_type counter threshold')
+
+# Badges earned once a counter reaches a threshold. A rule's position is
+# its bit in UserScore.badge_bits, so only ever append to this list.
+BADGE_RULES = [
+    BadgeRule('First Post', 'posts_count', 1),
+    BadgeRule('Active Poster', 'posts_count', 5),
+    BadgeRule('Social Butterfly', 'messages_count', 10),
+    BadgeRule('Job Creator', 'jobs_count', 1),
+    BadgeRule('Event Organizer', 'events_count', 1),
+]
+RULE_BITS = {rule.badge_type: 1 << bit for bit, rule in enumerate(BADGE_RULES)}
+
+def _score(counts):
+    return sum(SCORE_WEIGHTS[counter] * counts.get(counter, 0) for counter in SCORE_WEIGHTS)
+
+@event.listens_for(User, 'after_insert')
+def _create_user_score(mapper, connection, target):
+    connection.execute(insert(UserScore.__table__).values(user_id=target.id))
+
+def bump_score(user_id, counter, delta=1):
+    """Add delta to one of a user's counters and to their score. The caller commits.
+
+    Returns the user's counters and badge_bits after the change, read
+    back in the same UPDATE ... RETURNING statement.
+    """
+    column = getattr(UserScore, counter)
+    row = db.session.execute(
+        update(UserScore).where(UserScore.user_id == user_id).values({
+            column: column + delta,
+            UserScore.score: UserScore.score + SCORE_WEIGHTS[counter] * delta,
+        }).returning(*[getattr(UserScore, name) for name in SCORE_WEIGHTS], UserScore.badge_bits),
+        execution_options={'synchronize_session': False},
+    ).mappings().first()
+    if counter in DAILY_SOURCES:
+        _bump_daily(user_id, counter, delta)
+    if row is None:
+        return refresh_user_score(user_id)
+    return dict(row)
+
+def _bump_daily(user_id, counter, delta):
+    """Add delta to today's DailyScore bucket for the user, creating it on first use."""
+    column = getattr(DailyScore, counter)
+    day = datetime.utcnow().date()
+    points = SCORE_WEIGHTS[counter] * delta
+    result = db.session.execute(
+        update(DailyScore).where(DailyScore.user_id == user_id, DailyScore.day == day).values({
+            column: column + delta,
+            DailyScore.score: DailyScore.score + points,
+        }),
+        execution_options={'synchronize_session': False},
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(DailyScore.__table__).values(user_id=user_id, day=day, score=points, **{counter: delta}))
+
+def _earned_bits(badge_types):
+    bits = 0
+    for badge_type in badge_types:
+        bits |= RULE_BITS.get(badge_type, 0)
+    return bits
+
+def refresh_user_score(user_id):
+    """Recount one user's counters and earned badges from the source tables. The caller commits."""
+    values = db.session.query(*[
+        db.select(db.func.count()).select_from(model).where(owner == user_id).scalar_subquery()
+        for model, owner in COUNTER_SOURCES.values()
+    ]).one()
+    counts = dict(zip(COUNTER_SOURCES, values))
+    counts['badge_bits'] = _earned_bits(badge_type for (badge_type,) in db.session.query(Badge.badge_type).filter(
+        Badge.user_id == user_id, Badge.badge_type.in_(RULE_BITS)))
+    db.session.merge(UserScore(user_id=user_id, score=_score(counts), **counts))
+    return counts
+
+def award_badges(user_id, counters):
+    """Award the rule badges that counters (as returned by bump_score) now qualify for. The caller commits.
+
+    Checks each rule against the counters in memory and only touches
+    the database when a badge is actually earned.
+    """
+    earned = counters['badge_bits']
+    new_rules = [rule for rule in BADGE_RULES
+                 if not earned & RULE_BITS[rule.badge_type] and counters[rule.counter] >= rule.threshold]
+    if not new_rules:
+        return []
+    for rule in new_rules:
+        db.session.add(Badge(user_id=user_id, badge_type=rule.badge_type))
+    bits = _earned_bits(rule.badge_type for rule in new_rules)
+    bump_score(user_id, 'badges_count', len(new_rules))
+    UserScore.query.filter_by(user_id=user_id).update(
+        {UserScore.badge_bits: UserScore.badge_bits.op('|')(bits)}, synchronize_session=False)
+    on_commit(lambda: invalidate_user_stats(user_id))
+    return [rule.badge_type for rule in new_rules]
+
+def backfill_user_scores():
+    """Fill user_score for every user with one grouped count per source table."""
+    counts = defaultdict(dict)
+    for counter, (model, owner) in COUNTER_SOURCES.items():
+        for user_id, count in db.session.query(owner, db.func.count()).group_by(owner):
+            counts[user_id][counter] = count
+    rows = []
+    for (user_id,) in db.session.query(User.id):
+        user_counts = {counter: counts[user_id].get(counter, 0) for counter in COUNTER_SOURCES}
+        rows.append({'user_id': user_id, 'score': _score(user_counts), **user_counts})
+    if rows:
+        db.session.execute(insert(UserScore.__table__), rows)
+    backfill_badge_bits()
+
+def backfill_badge_bits():
+    """Set every user's badge_bits from the rule badges they already hold."""
+    earned = defaultdict(list)
+    for user_id, badge_type in db.session.query(Badge.user_id, Badge.badge_type).filter(Badge.badge_type.in_(RULE_BITS)):
+        earned[user_id].append(badge_type)
+    db.session.execute(update(UserScore).values(badge_bits=0), execution_options={'synchronize_session': False})
+    rows = [{'b_user_id': user_id, 'b_bits': _earned_bits(badge_types)} for user_id, badge_types in earned.items()]
+    if rows:
+        db.session.connection().execute(
+            update(UserScore.__table__).where(UserScore.__table__.c.user_id == db.bindparam('b_user_id')).values(
+                badge_bits=db.bindparam('b_bits')), rows)
+
+def top_scores(limit=100):
+    """Return the highest UserScore rows, best first, read off ix_user_score_rank."""
+    return UserScore.query.options(db.joinedload(UserScore.user)).order_by(
+        UserScore.score.desc(), UserScore.user_id
+    ).limit(limit).all()
+
+def recompute_position_badges():
+    """Give the top three their place badges, writing only what changed.
+
+    Returns the IDs of users whose badges changed.
+    """
+    top = [user_id for (user_id,) in db.session.query(UserScore.user_id).order_by(
+        UserScore.score.desc(), UserScore.user_id).limit(len(POSITION_BADGES))]
+    current, stale = {}, []
+    for badge in Badge.query.filter(Badge.badge_type.in_(POSITION_BADGES)).order_by(Badge.id):
+        if badge.badge_type in current:
+            stale.append(badge)
+        else:
+            current[badge.badge_type] = badge
+    changed = set()
+    for place, badge_type in enumerate(POSITION_BADGES):
+        user_id = top[place] if place < len(top) else None
+        badge = current.get(badge_type)
+        if badge is not None and badge.user_id == user_id:
+            continue
+        if badge is not None:
+            stale.append(badge)
+        if user_id is not None:
+            db.session.add(Badge(user_id=user_id, badge_type=badge_type))
+            bump_score(user_id, 'badges_count')
+            changed.add(user_id)
+    for badge in stale:
+        db.session.delete(badge)
+        bump_score(badge.user_id, 'badges_count', -1)
+        changed.add(badge.user_id)
+    if changed:
+        db.session.commit()
+        for user_id in changed:
+            invalidate_user_stats(user_id)
+    return changed
+
+position_badge_job = PeriodicJob('position-badges', lambda app: recompute_position_badges())
@@ -0,0 +1,92 @@
+from models import db, Activity
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+import atexit
+import queue
+import threading
+
+def on_commit(callback):
+    """Run callback once the current session's transaction commits.
+
+    Dropped if it rolls back instead, so caches are only invalidated for
+    writes that actually happened.
+    """
+    db.session.info.setdefault('on_commit', []).append(callback)
+
+@event.listens_for(Session, 'after_commit')
+def _run_on_commit(session):
+    for callback in session.info.pop('on_commit', []):
+        callback()
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_on_commit(session):
+    session.info.pop('on_commit', None)
+
+class WriteBehindQueue:
+    """Buffers rows for one model and inserts them from a background thread.
+
+    For rows nothing in the request depends on (e.g. activity feed
+    entries): put() returns at once and the worker inserts whatever has
+    queued up every `interval` seconds, up to batch_size rows per
+    executemany, in its own transaction. Rows still queued at exit are
+    flushed; rows in a failed batch are dropped.
+    """
+
+    def __init__(self, model, batch_size=200, interval=1.0):
+        self.model = model
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.app = None
+        self.flush_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.app is not None
+
+    def start(self, app):
+        if self.running:
+            return
+        self.app = app
+        threading.Thread(target=self.work, name=f'write-behind-{self.model.__tablename__}', daemon=True).start()
+        atexit.register(self.flush)
+
+    def put(self, **values):
+        self.queue.put(values)
+
+    def _take(self, block):
+        rows = []
+        try:
+            if block:
+                rows.append(self.queue.get(timeout=self.interval))
+            while len(rows) < self.batch_size:
+                rows.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return rows
+
+    def _insert(self, rows):
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(self.model), rows)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f'Dropped {len(rows)} queued {self.model.__tablename__} rows: {e}')
+
+    def flush(self):
+        """Insert everything queued so far."""
+        with self.flush_lock:
+            rows = self._take(block=False)
+            while rows:
+                self._insert(rows)
+                rows = self._take(block=False)
+
+    def work(self):
+        while True:
+            rows = self._take(block=True)
+            if rows:
+                with self.flush_lock:
+                    self._insert(rows)
+
+activity_queue = WriteBehindQueue(Activity)
@@ -0,0 +1,24 @@
+from models import db, Post, Badge
+from cache import TTLCache
+
+# user_id -> counters shown on the dashboard; dropped by the write paths that change them
+user_stats_cache = TTLCache(maxsize=1024, ttl=60)
+
+def get_user_stats(user_id):
+    """Return a user's post and badge counts, from one aggregate query or the cache."""
+    stats = user_stats_cache.get(user_id)
+    if stats is None:
+        posts_count, badges_count = db.session.query(
+            db.select(db.func.count(Post.id)).where(Post.user_id == user_id).scalar_subquery(),
+            db.select(db.func.count(Badge.id)).where(Badge.user_id == user_id).scalar_subquery(),
+        ).one()
+        stats = {'posts_count': posts_count, 'badges_count': badges_count}
+        user_stats_cache.set(user_id, stats)
+    return stats
+
+def invalidate_user_stats(user_id=None):
+    """Forget cached stats for one user, or for everyone when user_id is None."""
+    if user_id is None:
+        user_stats_cache.clear()
+    else:
+        user_stats_cache.pop(user_id)
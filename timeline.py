@@ -0,0 +1,114 @@
+from models import db, Post
+from cache import StampFile
+from datetime import datetime
+from itertools import dropwhile, islice
+import heapq
+import threading
+import time
+
+def encode_cursor(timestamp, post_id):
+    return f'{timestamp.isoformat()}_{post_id}'
+
+def decode_cursor(cursor):
+    """Parse a feed cursor into a (timestamp, post_id) key; None if malformed."""
+    try:
+        timestamp, post_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(post_id)
+    except (AttributeError, ValueError):
+        return None
+
+class Timelines:
+    """Per-audience lists of the newest (timestamp, post ID) keys, newest first.
+
+    Each list keeps at most `size` entries. Call open() (or build()) at
+    startup and add() from create_post. add() also replaces a stamp file,
+    the same way SocialGraph does, and other worker processes rebuild on
+    their next page once the stamp has changed. Posts written outside the
+    app are picked up once the lists are older than max_age seconds.
+    """
+
+    def __init__(self, size=500, max_age=300):
+        self.size = size
+        self.max_age = max_age
+        self.lists = {}
+        self.built_at = None
+        self.stamp_file = StampFile()
+        self.stamp = None
+        self.lock = threading.RLock()
+
+    def open(self, stamp_path):
+        """Build the lists and follow other processes' posts through stamp_path."""
+        self.stamp_file.open(stamp_path)
+        self.build()
+
+    def build(self):
+        """(Re)load the newest posts of every audience."""
+        # Read before querying, so a post committed during the build triggers another one
+        stamp = self.stamp_file.stamp()
+        lists = {}
+        for (audience,) in db.session.query(Post.audience).distinct().all():
+            rows = db.session.query(Post.timestamp, Post.id).filter(
+                Post.audience == audience
+            ).order_by(Post.timestamp.desc(), Post.id.desc()).limit(self.size).all()
+            lists[audience] = [(timestamp, post_id) for timestamp, post_id in rows]
+        with self.lock:
+            self.lists = lists
+            self.built_at = time.monotonic()
+            self.stamp = stamp
+
+    def _ensure_fresh(self):
+        if (self.built_at is None or time.monotonic() - self.built_at > self.max_age
+                or self.stamp_file.stamp() != self.stamp):
+            self.build()
+
+    def add(self, post):
+        """Insert a committed post and tell other processes to rebuild."""
+        key = (post.timestamp, post.id)
+        with self.lock:
+            self._ensure_fresh()
+            entries = self.lists.setdefault(post.audience, [])
+            i = 0
+            while i < len(entries) and entries[i] > key:
+                i += 1
+            if i == len(entries) or entries[i] != key:  # a rebuild may have loaded it already
+                entries.insert(i, key)
+                del entries[self.size:]
+            self.stamp = self.stamp_file.touch()
+
+    def page(self, audiences, before=None, limit=10):
+        """Return up to `limit` keys older than `before` across audiences, newest first.
+
+        Returns None when the in-memory lists are too short to answer, in
+        which case the caller has to ask the database.
+        """
+        with self.lock:
+            self._ensure_fresh()
+            candidates = []
+            for audience in audiences:
+                entries = self.lists.get(audience, [])
+                older = entries if before is None else list(dropwhile(lambda key: key >= before, entries))
+                if len(older) < limit and len(entries) >= self.size:
+                    return None
+                candidates.append(older[:limit])
+        return list(islice(heapq.merge(*candidates, reverse=True), limit))
+
+timelines = Timelines()
+
+def feed_page(audiences, cursor=None, limit=10):
+    """Return (posts, next cursor) for a feed of the given audiences, newest first.
+
+    Pages are keyed on (timestamp, id), so a page costs the same however
+    deep it is. next cursor is None once the feed is exhausted.
+    """
+    before = decode_cursor(cursor) if cursor else None
+    keys = timelines.page(audiences, before, limit)
+    if keys is None:
+        query = db.session.query(Post.timestamp, Post.id).filter(Post.audience.in_(audiences))
+        if before is not None:
+            query = query.filter((Post.timestamp < before[0]) | ((Post.timestamp == before[0]) & (Post.id < before[1])))
+        keys = query.order_by(Post.timestamp.desc(), Post.id.desc()).limit(limit).all()
+    post_ids = [post_id for _, post_id in keys]
+    posts_by_id = {post.id: post for post in Post.query.options(db.joinedload(Post.user)).filter(Post.id.in_(post_ids)).all()} if post_ids else {}
+    posts = [posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id]
+    next_cursor = encode_cursor(*keys[-1]) if len(keys) == limit else None
+    return posts, next_cursor